@@ -0,0 +1,186 @@
+"""Benchmarks of the overheads of `xp` itself (not of the experiments).
+
+Usage: `python benchmarks/bench.py [--quick] [--only dispatch,save,mp,rsync,imports] [--out FILE]`
+
+Prints one JSON record per measurement (also appended to `--out`), e.g.
+`{"bench": "mp", "work": "noop", "nCPU": 4, "chunksize": 10, "n": 4000, "seconds": 0.31, ...}`
+so that runs (e.g. before/after a change) can be compared with `pandas.read_json(lines=True)`.
+NB: stdout also gets the progress output of `dispatch` ⇒ prefer `--out` for a clean file.
+Benchmarks requiring `ssh localhost` (and `rsync`) are recorded as skipped if unavailable.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import xp
+from xp import local_mp
+
+# Experiments (dispatched) are imported from this script, which lives in a throwaway "project",
+# since `dispatch` uploads/copies the `proj_dir` (and refuses if it is too close to home).
+SCRIPT = '''
+def noop(i=0):
+    return i
+'''
+
+
+def busy(seconds):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        pass
+
+
+WORK = {
+    "noop": lambda i: i,
+    "short": lambda i: busy(0.001),  # 1 ms
+    "long": lambda i: busy(0.05),  # 50 ms
+}
+
+
+def timer(fun, *args, **kwargs):
+    t0 = time.perf_counter()
+    fun(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def ssh_localhost():
+    args = ["ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=5", "localhost", "true"]
+    try:
+        return subprocess.run(args, capture_output=True).returncode == 0 and shutil.which("rsync")
+    except FileNotFoundError:
+        return False
+
+
+class Bench:
+    def __init__(self, quick, out=None):
+        self.quick = quick
+        self.out = out
+        self.tmp = Path(tempfile.mkdtemp(prefix="xp-bench-"))
+        self.proj = Path.home() / ".cache" / "xp-bench" / "proj"
+        self.proj.mkdir(parents=True, exist_ok=True)
+        (self.proj / "pyproject.toml").write_text('[project]\nname = "proj"\nversion = "0"\n')
+        (self.proj / "bench_xps.py").write_text(SCRIPT)
+        self.meta = dict(machine=platform.node(), python=platform.python_version())
+        self.meta["cpus"] = os.cpu_count()
+        try:
+            self.meta["sha"] = xp.git_sha()
+        except subprocess.CalledProcessError:
+            self.meta["sha"] = None
+
+    def record(self, bench, **fields):
+        rec = dict(bench=bench, **fields, **self.meta)
+        line = json.dumps(rec)
+        print(line, flush=True)
+        if self.out:
+            with open(self.out, "a") as f:
+                f.write(line + "\n")
+
+    def skip(self, bench, reason, **fields):
+        self.record(bench, **fields, skipped=reason)
+
+    def dispatch(self):
+        """Per-xp overhead of `dispatch`: locally (subprocess) and via `ssh localhost`."""
+        sys.path.insert(0, str(self.proj))
+        import bench_xps
+
+        hosts = [None] + (["localhost"] if ssh_localhost() else [])
+        if len(hosts) == 1:
+            self.skip("dispatch", "ssh localhost unavailable", host="localhost")
+        for host in hosts:
+            for n in [10, 100] if self.quick else [10, 100, 1000, 10_000]:
+                xps = [dict(i=i) for i in range(n)]
+                kws = dict(script=self.proj / "bench_xps.py", proj_dir=self.proj)
+                kws |= dict(data_root=self.tmp / f"data-{host}-{n}", nCPU=2)
+                if host:
+                    kws |= dict(data_root_on_remote=self.tmp / "remote")
+                seconds = timer(xp.dispatch, bench_xps.noop, xps, host, **kws)
+                host = host or "SUBPROCESS"
+                self.record("dispatch", host=host, n=n, seconds=seconds, per_xp=seconds / n)
+
+    def save(self):
+        """Throughput of `save` (i.e. `dill`) vs. number and size of xps."""
+        for n in [1000, 10_000] if self.quick else [1000, 10_000, 100_000]:
+            for size in [0, 1000, 100_000]:  # bytes of array in each xp
+                if n * size > 2e9:
+                    continue
+                xps = [dict(i=i, x=np.zeros(size // 8)) for i in range(n)]
+                data_dir = xp.mk_data_dir(self.tmp / "save", tags=f"{n}-{size}")
+                seconds = timer(xp.save, xps, data_dir, nBatch=4)
+                nBytes = sum(p.stat().st_size for p in (data_dir / "xps").iterdir())
+                shutil.rmtree(data_dir)
+                rec = dict(n=n, size=size, seconds=seconds, xps_per_s=n / seconds)
+                self.record("save", **rec, MB_per_s=nBytes / seconds / 1e6)
+
+    def mp(self):
+        """Strong scaling of `local_mp.mp` over `nCPU`, `backend` and `chunksize`."""
+        nCPUs = sorted({1, 2, os.cpu_count()} if self.quick else {1, 2, 4, 8, os.cpu_count()})
+        nCPUs = [c for c in nCPUs if c <= os.cpu_count()]
+        for work, f in WORK.items():
+            n = {"noop": 4000, "short": 1000, "long": 40}[work]
+            if self.quick:
+                n //= 4
+            for nCPU in nCPUs:
+                for backend, chunksize in itertools.product(local_mp.BACKENDS, [None, 1, 10, 100]):
+                    if nCPU == 1 and (chunksize or backend != "process"):
+                        continue  # no pool
+                    kws = dict(quiet=True, backend=backend)
+                    local_mp.mp(f, range(nCPU), nCPU, **kws)  # warm up pool
+                    seconds = timer(local_mp.mp, f, range(n), nCPU, chunksize=chunksize, **kws)
+                    rec = dict(work=work, nCPU=nCPU, backend=backend, chunksize=chunksize, n=n)
+                    self.record("mp", **rec, seconds=seconds, xps_per_s=n / seconds)
+
+    def rsync(self):
+        """Cost of `Uplink.sym_sync` vs. size of project dir: initial upload, and no-op re-sync."""
+        if not ssh_localhost():
+            return self.skip("rsync", "ssh localhost (or rsync) unavailable")
+        remote = xp.uplink.Uplink("localhost")
+        for nFiles in [10, 100] if self.quick else [10, 100, 1000, 10_000]:
+            src = self.tmp / f"src{nFiles}"
+            (src / "proj").mkdir(parents=True)
+            for i in range(nFiles):
+                (src / "proj" / f"f{i}.py").write_bytes(os.urandom(4000))
+            target = self.tmp / f"target{nFiles}"
+            for run in ["initial", "re-sync"]:
+                t0 = time.perf_counter()
+                with remote.sym_sync(target, src):
+                    pass
+                seconds = time.perf_counter() - t0
+                self.record("rsync", nFiles=nFiles, run=run, seconds=seconds)
+
+    def imports(self):
+        """Startup cost of the worker (`launch_xps`) and of `xp`, as per `python -X importtime`."""
+        for module in ["xp", "xp.launch_xps", "xp.uplink", "xp.results"]:
+            args = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+            lines = subprocess.run(args, check=True, capture_output=True, text=True).stderr
+            for line in lines.splitlines():
+                *_, cumulative, name = line.split("|")
+                if name.strip() == module:
+                    self.record("imports", module=module, seconds=int(cumulative) / 1e6)
+
+    def cleanup(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="Fewer/smaller sizes")
+    parser.add_argument("--only", default="dispatch,save,mp,rsync,imports")
+    parser.add_argument("--out", help="Also append records to this file")
+    args = parser.parse_args()
+
+    bench = Bench(args.quick, args.out)
+    try:
+        for name in args.only.split(","):
+            getattr(bench, name)()
+    finally:
+        bench.cleanup()
@@ -1,8 +1,7 @@
 import numpy as np
 import numpy.random as rnd
 
-from xp import dispatch
-import xp.tools
+from xp import ParamSpace, dispatch
 
 
 def experiment(seed=None, method=None, N=None):
@@ -34,15 +33,16 @@ def list_experiments():
         if method == "deterministic":
             kws["seed"] = None
         xps.append(dict(method=method, **kws))
+    xps = ParamSpace.from_dicts(xps)
 
     # Convenience function to re-do each experiment for a list of common parameters.
-    common = xp.tools.dict_prod(
+    common = ParamSpace.product(
         seed=3000 + np.arange(5),
         N=[10, 100, 1000],
     )
     # Combine: each xps item gets all common combinations
-    xps = [{**c, **d} for c in common for d in xps]  # {common, xp} share any key ⇒ dupes
-    xps = [dict(t) for t in {tuple(d.items()) for d in xps}]  # remove dupes
+    xps = common * xps  # {common, xp} share any key ⇒ dupes
+    xps = xps.dedupe()  # remove dupes
     return xps
 
 
@@ -51,3 +51,5 @@ if __name__ == "__main__":
     # results = [experiment(**kwargs) for kwargs in xps]
     host = "localhost"  # or "my-gcp-*" or "cno-0001" or "hpc.intra.norceresearch" or None
     data_dir = dispatch(experiment, xps, host)
+    # Alternatively, only run as many seeds as needed (per configuration) for the mean error
+    # to converge, using `xp.adaptive.sweep(experiment, xps_without_seeds, stat, tol, seeds)`.
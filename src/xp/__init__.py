@@ -1,24 +1,73 @@
+import bisect
+import hashlib
+import itertools
+import json
+import queue
 import shutil
 import sys
-import re
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from tqdm.auto import tqdm
-from tempfile import NamedTemporaryFile
 
 import dill
 
-from . import uplink
-from .launch_xps import mp
+from . import serial, store
+
+# Lazily imported (see `__getattr__`), so that importing `xp` (e.g. by the workers) is fast,
+# i.e. does not import the analysis/orchestration modules, nor their deps (numpy, tqdm).
+_lazy = {
+    "Cache": "cache",
+    "CostModel": "costs",
+    "mp": "local_mp",
+    "ParamSpace": "params",
+    "load_reduced": "reduce",
+    "load": "results",
+    "load_stats": "results",
+}
+_submodules = [
+    "adaptive",
+    "cache",
+    "catalog",
+    "costs",
+    "local_mp",
+    "params",
+    "pilot",
+    "progress",
+    "reduce",
+    "results",
+    "slurm",
+    "uplink",
+]
+
+
+def __getattr__(name):
+    from importlib import import_module
+
+    if name in _lazy:
+        return getattr(import_module(f".{_lazy[name]}", __name__), name)
+    if name in _submodules:
+        return import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 timestamp = "%Y-%m-%d_at_%H-%M-%S"
 responsive = dict(check=True, capture_output=True, text=True)
 
 
 def find_latest_run(root: Path):
-    """Find the latest experiment (dir containing many)"""
+    """Find the latest experiment (dir containing many) of `root` (i.e. `data_root/proj/script`).
+
+    Looked up in the `catalog` (of `data_root`), else (runs not in it) by scanning `root`.
+    """
+    from . import catalog
+
+    root = Path(root).expanduser()
+    if len(root.parts) > 2:
+        runs = catalog.query(root.parents[1], proj=root.parent.name, script=root.name, limit=1)
+        if runs:
+            return Path(runs[0]["path"]).name
     lst = []
     for f in root.iterdir():
         try:
@@ -38,9 +87,12 @@ def git_dir():
     return Path(git_dir)
 
 
-def git_sha():
-    """Get project HEAD 'sha'."""
-    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], **responsive).stdout.strip()
+def git_sha(repo: Path = None, short=True, check=True):
+    """Get project (`repo`, default: cwd) HEAD 'sha'. If not `check`: `None` if not a git repo."""
+    cmd = ["git", *(["-C", str(repo)] if repo else []), "rev-parse"]
+    cmd += ["--short", "HEAD"] if short else ["HEAD"]
+    proc = subprocess.run(cmd, **dict(responsive, check=check))
+    return proc.stdout.strip() if proc.returncode == 0 else None
 
 
 def mk_data_dir(
@@ -52,7 +104,10 @@ def mk_data_dir(
     if tags:
         data_dir /= tags
     else:
-        data_dir /= datetime.now().strftime(timestamp)
+        # Unique timestamp (i.e. wait if one was just made, e.g. by a previous round or pilot)
+        while (stamp := data_dir / datetime.now().strftime(timestamp)).exists() and mkdir:
+            time.sleep(0.1)
+        data_dir = stamp
 
     if mkdir:
         data_dir.mkdir(parents=True)
@@ -62,6 +117,19 @@ def mk_data_dir(
     return data_dir
 
 
+def ssh_hosts(host: str):
+    """Expand host alias "glob" (trailing `*`) into all matching hosts in `~/.ssh/config`."""
+    if not host.endswith("*"):
+        return [host]
+    hosts = []
+    for line in (Path("~").expanduser() / ".ssh" / "config").read_text().splitlines():
+        if line.startswith("Host " + host[:-1]):
+            hosts.append(line.split()[1])
+    if not hosts:
+        raise ValueError(f"No host in ~/.ssh/config matches {host!r}")
+    return hosts
+
+
 def prj_dir(script: Path):
     """Find python project's root dir.
 
@@ -76,24 +144,193 @@ def prj_dir(script: Path):
                 return d
 
 
-def save(xps, data_dir, nBatch):
-    print(f"Saving {len(xps)} xp's to", data_dir)
-    batch_size = 1 + len(xps) // nBatch
+def shards(n, nBatch):
+    """Bounds `(start, stop)` of (at most) `nBatch` shards of `range(n)`, balanced exactly."""
+    nBatch = max(1, min(nBatch, n))
+    edges = [i * n // nBatch for i in range(nBatch + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def save(xps, data_dir, nBatch, subdir="xps", codec=None, executor=None):
+    """Save `xps` (or results) in `nBatch` shards, and record their offsets in the manifest.
+
+    With `executor`, the shards get written by it (i.e. in the background),
+    and the futures (of their paths) are returned, in order.
+    """
+    print(f"Saving {len(xps)} {subdir} to", data_dir)
+    bounds = shards(len(xps), nBatch)
+
+    path = data_dir / "manifest.json"
+    entries = json.loads(path.read_text()) if path.exists() else {}
+    entries[subdir] = dict(offsets=[a for a, _ in bounds], counts=[b - a for a, b in bounds])
+    path.write_text(json.dumps(entries))
 
     def save_batch(i):
-        xp_batch = xps[i * batch_size : (i + 1) * batch_size]
-        (data_dir / "xps" / str(i)).write_bytes(dill.dumps(xp_batch))
+        start, stop = bounds[i]
+        xp_batch = xps[start:stop]
+        path = data_dir / subdir / str(i)
+        if subdir == "res":
+            with store.Writer(path, codec) as writer:
+                for j, result in enumerate(xp_batch):
+                    writer.append(j, result)
+        else:
+            serial.dump(xp_batch, path, codec)
+        return path
+
+    if executor:
+        return [executor.submit(save_batch, i) for i in range(len(bounds))]
+    # Threads, since mostly I/O (and so the shards are not shipped to other processes)
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(save_batch, range(len(bounds))))
+
+
+def manifest(data_dir, subdir="xps"):
+    """The `offsets` and `counts` of the batches (shards) of `data_dir/subdir`."""
+    path = Path(data_dir) / "manifest.json"
+    if path.exists() and subdir in (entries := json.loads(path.read_text())):
+        return entries[subdir]
+    # Older data_dir ⇒ count
+    paths = sorted((Path(data_dir) / subdir).iterdir(), key=lambda p: int(p.name))
+    counts = [len(serial.load(p)) for p in paths]
+    offsets = [sum(counts[:i]) for i in range(len(counts))]
+    return dict(offsets=offsets, counts=counts)
 
-    # saving can be slow ⇒ mp
-    mp(save_batch, range(nBatch))
+
+def locate(data_dir, i):
+    """Batch and index (within it) of the `i`-th xp of `data_dir`."""
+    offsets = manifest(data_dir)["offsets"]
+    batch = bisect.bisect_right(offsets, i) - 1
+    return batch, i - offsets[batch]
+
+
+def load_batches(data_dir, subdir="res"):
+    """Load and concatenate the batches of `data_dir/subdir`, i.e. undo `save`."""
+    paths = sorted((data_dir / subdir).iterdir(), key=lambda p: int(p.name))
+    if subdir == "res":
+        return [x for p in paths for x in store.load(p)]
+    return [x for p in paths for x in serial.load(p)]
+
+
+def incomplete(data_dir):
+    """Indices of the batches of `data_dir` that are missing results."""
+    counts = manifest(data_dir)["counts"]
+    nDone = [len(store.done(data_dir / "res" / str(i))) for i in range(len(counts))]
+    return [i for i, (n, count) in enumerate(zip(nDone, counts)) if n < count]
+
+
+def failures(data_dir):
+    """The failed xps (see `dispatch(retries=...)`) of `data_dir` that are (still) missing results.
+
+    Each is a `dict` with `xp` (index), `batch`, `index` (within batch), `kwargs`, `type`, ...
+    """
+    data_dir = Path(data_dir)
+    offsets = manifest(data_dir)["offsets"]
+    fails = []
+    for batch, offset in enumerate(offsets):
+        records = dict(store.read(data_dir / "fail" / str(batch)))
+        if records:
+            done = store.done(data_dir / "res" / str(batch))
+            xps = serial.load(data_dir / "xps" / str(batch))
+            for i, rec in sorted(records.items()):
+                if i not in done:
+                    loc = dict(xp=offset + i, batch=batch, index=i, kwargs=xps[i])
+                    fails.append(dict(**loc, **rec))
+    return fails
+
+
+def warn_failures(data_dir):
+    if fails := failures(data_dir):
+        print(
+            f"Warning: {len(fails)} xp(s) failed, e.g. {fails[0]['error']}.",
+            f"See `xp.failures({str(data_dir)!r})`.",
+            f"Re-run (only) them with `dispatch(resume={str(data_dir)!r})`.",
+        )
+
+
+def env_fingerprint(proj_dir: Path):
+    """Hash of the files that determine the venv (lockfile, `pyproject.toml`, `.python-version`).
+
+    NB: `sync_venv` also checks the version of the interpreter of the venv itself.
+    """
+    h = hashlib.sha1()
+    for name in ["uv.lock", "pyproject.toml", ".python-version", "requirements.txt"]:
+        if (proj_dir / name).exists():
+            h.update(name.encode() + (proj_dir / name).read_bytes())
+    return h.hexdigest()[:16]
+
+
+def sync_venv(remote, proj_dir_remote, venv, fingerprint=None):
+    """Install (potentially outdated) deps (from lockfile) on `remote`.
+
+    Skipped if `fingerprint` (see `env_fingerprint`) and the Python version of the `venv`
+    match those of the last sync (stored next to the `venv`).
+    But a packaged project (i.e. with `[build-system]`) is then still (re-)installed (editable,
+    w/o deps), lest the venv import it from where it was last synced (e.g. an older run).
+    NB: check and sync are done in a single ssh call.
+    """
+    # PS: Pre-install `uv` using `wget -qO- https://astral.sh/uv/install.sh | sh`
+    sync = f"UV_PROJECT_ENVIRONMENT={venv} uv sync"
+    if fingerprint:
+        stamp = f"{venv}.fingerprint"
+        current = f'"{fingerprint} $({venv}/bin/python -V 2>&1)"'
+        fresh = f'[ "$(cat {stamp} 2>/dev/null)" = {current} ]'
+        packaged = 'grep -qs "^\\[build-system\\]" pyproject.toml'
+        repoint = f"uv pip install -q --python {venv}/bin/python --no-deps -e ."
+        skip = f"echo venv up to date; if {packaged}; then {repoint}; fi"
+        sync = f"if {fresh}; then {skip}; else {sync} && echo {current} > {stamp}; fi"
+    remote.cmd(f"cd {proj_dir_remote}; {sync}", capture_output=False)  # simply print
+
+
+def place_launcher(script_dir: Path):
+    """Copy `launch_xps.py` into `script_dir` (i.e. next to the script it imports).
+
+    NB: Only if changed, lest its mtime changes the `uplink.fingerprint` (⇒ new snapshot).
+    """
+    launcher = Path(__file__).parent / "launch_xps.py"
+    target = Path(script_dir) / launcher.name
+    if not target.exists() or target.read_bytes() != launcher.read_bytes():
+        shutil.copy(launcher, target)
+
+
+def warmup(host: str | list, proj_dir: Path, setup: str = None, script: Path = None):
+    """Provision host(s), in parallel, ahead of `dispatch`.
+
+    I.e. upload `proj_dir` (snapshot) and sync its venv, which later dispatches then skip.
+    Also run `setup` (shell command, in `proj_dir` with venv activated),
+    e.g. to download data or warm up compilation caches (numba, jax).
+    Specify the `script` to be dispatched if it is not in `proj_dir` itself
+    (since its launcher is included in the snapshot).
+    """
+    from . import uplink
+
+    hosts = [host] if isinstance(host, str) else host
+    hosts = [h for pattern in hosts for h in ssh_hosts(pattern)]
+    proj_dir = Path(proj_dir).expanduser().resolve()
+    place_launcher(Path(script).expanduser().resolve().parent if script else proj_dir)
+    dst = f"~/.cache/xp/warm/{proj_dir.stem}"
+    venv = f"~/.cache/venvs/{proj_dir.stem}"
+
+    def prep(host):
+        remote = uplink.Uplink(host)
+        remote.snapshot(proj_dir, dst)
+        sync_venv(remote, dst, venv, env_fingerprint(proj_dir))
+        if setup:
+            remote.cmd(f"cd {dst}; source {venv}/bin/activate; {setup}", capture_output=False)
+
+    with ThreadPoolExecutor(min(len(hosts), uplink.MAX_TRANSFERS)) as executor:
+        list(executor.map(prep, hosts))
 
 
 def dispatch(
     fun: callable,
-    xps: list,
-    host: str = None,  # Server alias
+    xps: list,  # of kwargs dicts, or `ParamSpace`
+    host: str | list = None,  # Server alias(es), or alias "glob", e.g. "my-gcp-*"
     script: Path = None,  # Path to script containing `fun`
     nCPU: int = None,  # number of CPUs to engage
+    threads: int = None,  # BLAS threads per worker ⇒ nCPU/threads workers. See `local_mp.layout`
+    backend: str = "process",  # Workers are processes, or "thread"s (if `fun` releases the GIL)
+    mem: int = None,  # Memory budget (bytes) per worker ⇒ recycled if exceeded, and throttled
+    maxtasks: int = None,  # Recycle (i.e. restart) workers after this many chunks of xps
     nBatch: int = None,  # number of batches (splits) of xps
     # NB: `multiprocessing` module already does "chunking",
     # so this is intended to be used on clusters with queue systems.
@@ -101,6 +338,20 @@ def dispatch(
     proj_dir: Path = None,  # e.g. Path(__file__).parents[0]
     data_root: Path = Path.home() / "data",
     data_root_on_remote: Path = "~/data",
+    cache: bool = False,  # Only run xps whose results are not in cache (of previous dispatches)
+    resume: Path = None,  # `data_dir` of an interrupted dispatch, to be completed
+    sbatch: bool | dict = None,  # Use SLURM job array, with these `sbatch` options
+    # Default: True for "login-*" and NORCE HPC hosts.
+    cost: callable = None,  # Estimate of runtime of each xp (kwargs) ⇒ longest first
+    # Use "learn" to estimate from the timings recorded by previous dispatches.
+    instrument: bool = False,  # Also record CPU time, peak RSS, pid, host of each xp
+    profile: callable = None,  # Profile the xps (kwargs) for which this returns True
+    profiler: callable = None,  # Context manager `profiler(path)`. Default: cProfile
+    retries: int = None,  # Capture failures of xps (rather than failing the batch), and retry
+    isolate: bool = False,  # Run each xp in forked process ⇒ survive segfaults. Implies `retries`
+    reduce: callable = None,  # `reduce(xps, results)`, run where the results are
+    compress: str = None,  # Codec for (non-array parts of) xps and results, e.g. "zstd"
+    pilot: int | bool = None,  # Size the run by first running (this many, or ~1%) xps
 ):
     """
     Run `fun` on `xps` on various different hosts.
@@ -111,13 +362,67 @@ def dispatch(
     ... (data_root / data_dir / "xps").write_bytes(dill.dumps(xps))
     ... (data_root / data_dir / "res").write_bytes(dill.dumps(results))
 
+    With multiple hosts, the batches get run concurrently, each host fetching the next
+    batch whenever it finishes one. The batch of a host that fails is given to the others.
+
     The `proj_dir` must be a parent to `script`,
     and gets copied into (and so uploaded with) `data_dir` (which also mirrors path of `proj_dir`!).
     To promote independence of the uploaded code "environment" vs. whatever
     "happens to be" the `cwd` (less headaches!), the `proj_dir` should NOT be the `cwd`.
     Still, if possible (if subpath to `proj_dir`), the `cwd` is "preserved" on remote,
     such that resources specified relative to it (sloppy!) may be found.
+
+    With `cache`, results are also stored under `data_root` by hash of (`fun`, kwargs),
+    and only the xps not found there get run. The `data_dir` still contains all `xps`
+    (and their results), in the original order.
+
+    Results are written as they come, so if a dispatch gets interrupted
+    (crash, walltime, preemption), it can be completed by passing its `data_dir` as `resume`
+    (its saved xps are re-used), which only runs the xps that are missing results.
+
+    With `cost`, the xps (of each batch) are scheduled longest-first, in chunks of
+    similar cost, which avoids a long xp finishing last (on a single CPU), and lets
+    cheap xps get chunked together (reducing overhead). Only the relative sizes matter.
+
+    The `nCPU` (of each host) are split into workers × `threads`, the BLAS (numpy) of each worker
+    being limited to `threads`. The default is 1 (i.e. nCPU workers), unless there are fewer xps
+    (in the batch) than CPUs. Use `threads > 1` for xps dominated by (large) linear algebra.
+
+    For xps that leak memory (or use a lot of it), set `mem` (and/or `maxtasks`):
+    worker processes then get recycled when their RSS exceeds `mem` (or after `maxtasks`),
+    and their number is throttled by the available memory (see `local_mp.recycling`).
+
+    The wall time of each xp is recorded in `data_dir/stats` (see `load_stats`),
+    as is its CPU time, peak RSS, worker pid and host, if `instrument`.
+    The xps selected by `profile` get profiled into `data_dir/prof`.
+
+    With `retries` (or `isolate`), an xp that fails (all of its attempts) does not
+    fail its batch; it simply has no result, and its error gets recorded (see `failures`).
+    Re-run only the failed xps using `dispatch(resume=...)`.
+
+    The batches (of each host) get pipelined: the next one is queued before the current one is done,
+    so that its stragglers don't leave CPUs idle. Also, the first ones start running while the
+    later ones are still being saved. On remotes, moreover, each batch gets uploaded
+    while the previous one computes, and its results get downloaded as soon as it completes.
+    But with `reduce`, the results are reduced on the remote (once all are in),
+    and only the output (see `load_reduced`) is downloaded, not `res/`.
+    This requires a single host (or SLURM), i.e. that all results end up in one place.
+
+    With `pilot`, a (stratified) sample of the xps is run first (on the first host),
+    and their timings (and memory) are used to pick `nCPU` (memory permitting), `nBatch`,
+    `cost`, and SLURM walltime and memory (unless specified), see `pilot.plan`,
+    which also prints the projected cost of the run.
+
+    With `cache`, only the xps whose results are not cached get dispatched (as a nested run),
+    whose `data_dir` then gets the merged xps and results. If some of them failed,
+    complete them with `dispatch(..., cache=True, resume=data_dir)`.
     """
+    options = dict(locals())  # ⇒ forwarded by nested dispatches (e.g. of `cache` misses)
+    from . import catalog, progress, reduce as reduction, slurm, uplink
+    from .cache import Cache
+    from .costs import CostModel
+    from .pilot import run as run_pilot
+
     # Don't want to pickle `fun`, because it often contains very deep references,
     # and take up a lot of storage (especially if saved with each xp).
     # ⇒ Ensure we know the script from which we can import it.
@@ -135,148 +440,298 @@ def dispatch(
         raise RuntimeError(msg)
 
     data_dir = data_root / proj_dir.stem / script.relative_to(proj_dir).stem
-    data_dir = mk_data_dir(data_dir)
+    sha = git_sha(proj_dir, short=False, check=False)
+    record = dict(fun=fun.__name__, sha=sha)  # see `catalog`
+
+    if cache:
+        cache = Cache(data_dir / "cache", fun, script)
+        keys = [cache.key(kwargs) for kwargs in xps]
+        misses = [i for i, key in enumerate(keys) if key not in cache]
+        print(f"Cache: found {len(xps) - len(misses)} of {len(xps)} xp's.")
+        if misses:
+            if resume:  # i.e. the (incomplete) nested dispatch of the misses
+                resumed = [cache.key(kwargs) for kwargs in load_batches(Path(resume), "xps")]
+                if resumed != [keys[i] for i in misses]:
+                    raise ValueError(f"The xps of `resume` ({resume}) are not the cache misses.")
+            # NB: `reduce` is not forwarded (the results are needed for the cache), but run below.
+            skip = ["fun", "xps", "host", "cache", "reduce"]
+            kws = {k: v for k, v in options.items() if k not in skip}
+            kws |= dict(script=script, proj_dir=proj_dir)
+            data_dir = dispatch(fun, [xps[i] for i in misses], host, **kws)
+            if incomplete(data_dir):
+                msg = "Cannot merge with cache, since some xps failed. Complete using"
+                raise RuntimeError(f"{msg} `dispatch(..., cache=True, resume={str(data_dir)!r})`.")
+            for i, result in zip(misses, load_batches(data_dir)):
+                cache[keys[i]] = result
+            # Replace by the full (merged) xps and results.
+            # NB: stats (timings) are indexed by batch of misses ⇒ discarded too.
+            for subdir in ["xps", "res"]:
+                shutil.rmtree(data_dir / subdir)
+                (data_dir / subdir).mkdir()
+            for subdir in ["stats", "costs"]:
+                shutil.rmtree(data_dir / subdir, ignore_errors=True)
+        else:
+            data_dir = mk_data_dir(data_dir)
+        nBatch = nBatch or 1
+        save(xps, data_dir, nBatch, codec=compress)
+        save([cache[key] for key in keys], data_dir, nBatch, "res", compress)
+        if reduce:
+            (data_dir / "reducer").write_bytes(dill.dumps(reduce, recurse=True))
+            reduction.run(data_dir)
+        record |= dict(nXp=len(xps), nBatch=nBatch, status="done")
+        catalog.register(data_root, data_dir, xps, **record)
+        return data_dir
 
     # Host alias "glob"
     if host is None:
-        host = "SUBPROCESS"
-    elif host.endswith("*"):
-        for line in (Path("~").expanduser() / ".ssh" / "config").read_text().splitlines():
-            if line.startswith("Host " + host[:-1]):
-                host = line.split()[1]
-                break
-
-    # Place launch script in same dir as script
-    shutil.copy(Path(__file__).parent / "launch_xps.py", script.parent)
+        hosts = ["SUBPROCESS"]
+    else:
+        hosts = [host] if isinstance(host, str) else host
+        hosts = [h for pattern in hosts for h in ssh_hosts(pattern)]
+    host = hosts[0]
+    if sbatch is None:
+        sbatch = host.startswith("login-") or "hpc.intra.norceresearch" in host
+
+    # Size (and schedule) the run by a sample of the xps
+    costs = None  # of the xps, by `cost`
+    if pilot and not resume:
+        kws = dict(script=script, proj_dir=proj_dir, nCPU=nCPU, threads=threads, backend=backend)
+        kws |= dict(mem=mem, maxtasks=maxtasks)
+        kws |= dict(data_root=data_root, data_root_on_remote=data_root_on_remote)
+        args = None if host == "SUBPROCESS" else host, None if pilot is True else pilot
+        plan = run_pilot(fun, xps, *args, nHosts=len(hosts), sbatch=sbatch, **kws)
+        nCPU = nCPU or plan["nCPU"]
+        nBatch = nBatch or plan["nBatch"]
+        if not cost:
+            cost, costs = plan["cost"], plan["costs"]
+        if sbatch:
+            sbatch = {**plan["sbatch"], **(sbatch if isinstance(sbatch, dict) else {})}
+
+    data_dir = Path(resume) if resume else mk_data_dir(data_dir)
+
+    place_launcher(script.parent)
 
     # Save xps -- partitioned (for node distribution)
     if nBatch is None:
         nBatch = 40 if host.startswith("login-") else 1
-    save(xps, data_dir, nBatch)
+        if len(hosts) > 1:
+            nBatch = 4 * len(hosts)  # ⇒ load balancing via work stealing
+        if sbatch:
+            nBatch, _ = slurm.layout(len(xps), nCPU)
+    # NB: the batches get run as soon as they're written, i.e. while the later ones are saved
+    savers = ThreadPoolExecutor()
+    saving = []  # futures of the batches (paths) of xps
+    if not resume:
+        if cost == "learn":
+            cost = CostModel.learn(data_dir.parent)
+            if cost is None:
+                print("No timings (from previous dispatches) to learn costs from.")
+        if cost:
+            if costs is None:
+                is_model = isinstance(cost, CostModel)
+                costs = cost.predict(xps) if is_model else [cost(kwargs) for kwargs in xps]
+            (data_dir / "costs").mkdir()
+            save(list(map(float, costs)), data_dir, nBatch, "costs")
+        saving = save(xps, data_dir, nBatch, codec=compress, executor=savers)
+
+    def saved(path):
+        """Wait (if need be) for the batch `path` (of xps) to be written."""
+        if saving:
+            saving[int(path.name)].result()
+        return path
+
+    # Options for `launch_xps.py`
+    opts = dict(measure=dict(full=instrument, profile=profile), codec=compress)
+    opts["mp"] = dict(threads=threads, backend=backend, mem=mem, maxtasks=maxtasks)
+    if profiler:
+        opts["measure"]["profiler"] = profiler
+    if retries is not None or isolate:
+        opts["guard"] = dict(retries=retries or 0, isolate=isolate)
+    (data_dir / "opts").write_bytes(dill.dumps(opts, recurse=True))  # recurse ⇒ incl. globals
+    if reduce:
+        if len(hosts) > 1:
+            raise ValueError("`reduce` requires all results in one place, i.e. a single host.")
+        (data_dir / "reducer").write_bytes(dill.dumps(reduce, recurse=True))
+    total = sum(manifest(data_dir)["counts"]) if resume else len(xps)
 
     # List resulting paths
-    paths_xps = sorted((data_dir / "xps").iterdir(), key=lambda p: int(p.name))
+    if saving:
+        paths_xps = [data_dir / "xps" / str(i) for i in range(len(saving))]
+    else:
+        paths_xps = sorted((data_dir / "xps").iterdir(), key=lambda p: int(p.name))
     assert paths_xps, f"No files found in {data_dir}"
 
-    # Run locally via subprocess
-    if host == "SUBPROCESS":
-        for xp in paths_xps:
-            try:
-                # current_interpreter = "python" # requires active venv
-                current_interpreter = sys.executable
-                subprocess.run(
-                    [
-                        current_interpreter,
-                        script.parent / "launch_xps.py",
-                        script.stem,
-                        fun.__name__,
-                        xp,
-                        str(nCPU),
-                    ],
-                    check=True,
-                    cwd=Path.cwd(),
-                )
-            except subprocess.CalledProcessError:
-                raise
-
-    # Run on NORCE HPC cluster with SLURM queueing system
-    # elif "hpc.intra.norceresearch" in host:
-    #     remote = uplink.Uplink(host)
-    #
-    #     if data_root_on_remote is None:
-    #         data_root_on_remote = remote.cmd("env | grep USERWORK").stdout.splitlines()[0].split("=")[1]
-    #     data_dir_remote = data_root_on_remote / data_dir.relative_to(data_root)
-    #
-    #     with remote.sym_sync(data_dir_remote, data_dir_remote, cwd):
-    #         # Install (potentially outdated) deps (from lockfile)
-    #         # PS: Pre-install `uv` using `wget -qO- https://astral.sh/uv/install.sh | sh`
-    #         venv = f"~/.cache/venvs/{cwd.name}"
-    #         remote.cmd(
-    #             f"command cd {data_dir_remote / cwd.name}; UV_PROJECT_ENVIRONMENT={venv} uv sync",
-    #             capture_output=False,
-    #         )
-    #
-    #         # Send job submission script
-    #         with NamedTemporaryFile(mode="w+t", delete_on_close=False) as sbatch:
-    #             txt = (Path(__file__).parent / "slurm_script.sbatch").read_text()
-    #             txt = eval(f"f'''{txt}'''", {}, locals())
-    #             sbatch.write(txt)
-    #             sbatch.close()
-    #             remote.rsync(sbatch.name, data_dir_remote / "job_script.sbatch")
-    #
-    #         # Submit
-    #         job_id = remote.cmd(f"command cd {data_dir_remote}; sbatch job_script.sbatch")
-    #         print(job_id.stdout, end="")
-    #         job_id = int(re.search(r"job (\d*)", job_id.stdout).group(1))
-    #
-    #         # Monitor job progress
-    #         nJobs = len(paths_xps)
-    #         with tqdm(total=nJobs, desc="Jobs") as pbar:
-    #             unfinished = nJobs
-    #             while unfinished:
-    #                 time.sleep(1)  # dont clog the ssh uplink
-    #                 new = f"squeue -j {job_id} -h -t pending,running -r | wc -l"
-    #                 new = int(remote.cmd(new).stdout)
-    #                 inc = unfinished - new
-    #                 pbar.update(inc)
-    #                 unfinished = new
-    #
-    #         # Provide error summary
-    #         failed = f"sacct -j {job_id} --format=JobID,State,ExitCode,NodeList | grep -E FAILED"
-    #         failed = remote.cmd(failed, check=False).stdout.splitlines()
-    #         if failed:
-    #             regex = r"_(\d+).*(node-\d+) *$"
-    #             nodes = {int((m := re.search(regex, ln)).group(1)): m.group(2) for ln in failed}
-    #             for task in nodes:
-    #                 print(f" Error for job {job_id}_{task} on {nodes[task]} ".center(70, "="))
-    #                 print(remote.cmd(f"cat {data_dir_remote}/error/{task}").stdout)
-    #             raise RuntimeError(f"Task(s) {list(nodes)} had errors, see printout above.")
-
-    # Run on some other remote server
-    # NOTE:
-    # - See xp/setup-compute-node.sh for instructions on setting up a GCP VM.
-    # - Use "localhost" for testing/debugging w/o actual server.
-    else:
-        remote = uplink.Uplink(host)
+    # Register in catalog (of `data_root`), and keep its status up to date
+    record |= dict(hosts=",".join(hosts), nXp=total, nBatch=len(paths_xps), nCPU=nCPU)
+    catalog.register(data_root, data_dir, None if resume else xps, **record, status="running")
+
+    try:
+        # Run locally via subprocess
+        if host == "SUBPROCESS":
+            # current_interpreter = "python" # requires active venv
+            current_interpreter = sys.executable
+            cmd = [
+                current_interpreter,
+                script.parent / "launch_xps.py",
+                script.stem,
+                fun.__name__,
+                "-",  # ⇒ serve batches fed via stdin
+                str(nCPU),
+            ]
+            with progress.Tracker(total) as tracker:
+                with progress.Worker(tracker, "local", cmd, cwd=Path.cwd()) as worker:
+                    worker.serve(map(saved, paths_xps))
+            if reduce:
+                reduction.run(data_dir)
+
+        # Run on some other remote server(s), or on HPC cluster with SLURM queueing system
+        # NOTE:
+        # - See xp/setup-compute-node.sh for instructions on setting up a GCP VM.
+        # - Use "localhost" for testing/debugging w/o actual server.
+        else:
+            if data_root_on_remote is None:
+                data_root_on_remote = uplink.Uplink(host).cmd("echo $USERWORK").stdout.strip()
+            data_dir_remote = data_root_on_remote / data_dir.relative_to(data_root)
 
-        data_dir_remote = data_root_on_remote / data_dir.relative_to(data_root)
-        paths_xps = [data_dir_remote / xp.relative_to(data_dir) for xp in paths_xps]
+            # Only (re-)run incomplete batches
+            tasks = incomplete(data_dir) if resume else [int(xp.name) for xp in paths_xps]
 
-        # Make (try!) cwd such that the relative path of the script is same as locally
-        try:
-            cwd = Path.cwd().relative_to(proj_dir)
-        except ValueError:
-            print(
-                "Warning: The cwd is outside of the project path."
-                "But if your script is well crafted, everything should still work."
-            )
-            cwd = Path(".")
-        finally:
-            cwd = data_dir_remote / proj_dir.stem / cwd
-        script = data_dir_remote / proj_dir.stem / script.relative_to(proj_dir)
-
-        with remote.sym_sync(data_dir_remote, data_dir, proj_dir):
-            # Install (potentially outdated) deps (from lockfile)
-            # PS: Pre-install `uv` using `wget -qO- https://astral.sh/uv/install.sh | sh`
-            venv = f"~/.cache/venvs/{proj_dir.stem}"
-            remote.cmd(
-                f"cd {data_dir_remote / proj_dir.stem}; UV_PROJECT_ENVIRONMENT={venv} uv sync",
-                capture_output=False,  # simply print
-            )
-
-            # Run (`launch_xps.py` uses `mp` ⇒ no point parallelising this loop)
-            for xp in paths_xps:
-                remote.cmd(
-                    [
-                        # PS: A well-crafted script should be independend of cwd ...
-                        f"cd {cwd};",  # ... so should ideally be able to comment out this line.
-                        f"{venv}/bin/python",
-                        script.parent / "launch_xps.py",
-                        script.stem,
-                        fun.__name__,
-                        xp,
-                        nCPU,
-                    ],
-                    capture_output=False,  # simply print
+            # Make (try!) cwd such that the relative path of the script is same as locally
+            try:
+                cwd = Path.cwd().relative_to(proj_dir)
+            except ValueError:
+                print(
+                    "Warning: The cwd is outside of the project path."
+                    "But if your script is well crafted, everything should still work."
                 )
-    return data_dir
+                cwd = Path(".")
+            finally:
+                cwd = data_dir_remote / proj_dir.stem / cwd
+            script = data_dir_remote / proj_dir.stem / script.relative_to(proj_dir)
+            venv = f"~/.cache/venvs/{proj_dir.stem}"
+            fingerprint = env_fingerprint(proj_dir)
+
+            # Download batches as they complete (except for `res/` if it gets reduced)
+            subdirs = ["stats", "fail"] if reduce else ["res", "stats", "fail"]
+            exclude = []  # from final download
+
+            def pull(remote, batches):
+                paths = [f"{d}/{i}" for i in batches for d in subdirs]
+                remote.pull(data_dir_remote, data_dir, paths)
+
+            def reduce_remote(remote):
+                remote.push(data_dir_remote, data_dir, ["xps", "costs"])  # incl. the lazy ones
+                run = "import sys, xp.reduce as r; sys.exit(not r.run(sys.argv[1]))"
+                cmd = f'cd {cwd}; {venv}/bin/python -c "{run}" {data_dir_remote}'
+                if remote.cmd(cmd, check=False, capture_output=False).returncode == 0:
+                    exclude.append("res/")
+
+            if sbatch:
+                list(map(saved, paths_xps))  # ⇒ all uploaded (for the job array)
+                remote = uplink.Uplink(host)
+                with remote.sym_sync(data_dir_remote, data_dir, proj_dir, exclude=exclude):
+                    sync_venv(remote, data_dir_remote / proj_dir.stem, venv, fingerprint)
+                    _, nCPU = slurm.layout(total, nCPU, len(paths_xps))
+                    options = sbatch if isinstance(sbatch, dict) else {}
+                    fields = dict(venv=venv, cwd=cwd, script=script, fun_name=fun.__name__)
+                    on_done = partial(pull, remote)
+                    slurm.run(remote, data_dir_remote, tasks, nCPU, options, on_done, **fields)
+                    if reduce:
+                        reduce_remote(remote)
+                if not exclude:
+                    warn_failures(data_dir)
+                catalog.finish(data_root, data_dir)
+                return data_dir
+
+            # Queue of batches, from which each host fetches (when free)
+            todo = queue.SimpleQueue()
+            for i in tasks:
+                todo.put(data_dir_remote / "xps" / str(i))
+            errors = {}
+
+            # Pipeline (per host): the batches (xps) get uploaded as they are fetched,
+            # i.e. while the previous ones compute (the first one while the venv gets synced),
+            # and downloaded (in the background) as they complete.
+            lazy = ["/xps/*", "/costs/*"]  # ⇒ not uploaded by `sym_sync`
+
+            def work(host):
+                remote = uplink.Uplink(host)
+                taken = []  # fetched, but not done
+
+                def fetch():
+                    try:
+                        xp = todo.get_nowait()
+                    except queue.Empty:
+                        return None
+                    taken.append(xp)
+                    saved(xp)
+                    remote.push(data_dir_remote, data_dir, [f"xps/{xp.name}", f"costs/{xp.name}"])
+                    return xp
+
+                def done(xp):
+                    taken.remove(xp)
+                    downloads.append(transfers.submit(pull, remote, [xp.name]))
+
+                try:
+                    with (
+                        ThreadPoolExecutor(1) as transfers,
+                        remote.sym_sync(
+                            data_dir_remote, data_dir, proj_dir, exclude=exclude, lazy=lazy
+                        ),
+                    ):
+                        downloads = []
+                        venv_synced = transfers.submit(
+                            sync_venv, remote, data_dir_remote / proj_dir.stem, venv, fingerprint
+                        )
+                        first = fetch()
+                        venv_synced.result()
+
+                        cmd = [
+                            # PS: A well-crafted script should be independend of cwd ...
+                            f"cd {cwd};",  # ... so should ideally be able to drop this line.
+                            f"{venv}/bin/python",
+                            script.parent / "launch_xps.py",
+                            script.stem,
+                            fun.__name__,
+                            "-",  # ⇒ serve batches fed via stdin
+                            nCPU,
+                        ]
+                        if first is not None:
+                            with progress.Worker(tracker, host, remote.ssh_args(cmd)) as worker:
+                                worker.serve(itertools.chain([first], iter(fetch, None)), done)
+                        for download in downloads:
+                            download.result()
+                        if reduce:
+                            reduce_remote(remote)
+                except Exception as error:
+                    if len(hosts) == 1:
+                        raise
+                    errors[host] = error
+                    print(f"Warning: {host} failed ({error}). Leaving its batches to the others.")
+                    for xp in taken:
+                        todo.put(xp)
+
+            # NB: a thread per host (each runs a worker), but their transfers are bounded (`uplink`)
+            with progress.Tracker(total) as tracker, ThreadPoolExecutor(len(hosts)) as executor:
+                list(executor.map(work, hosts))
+
+            if not todo.empty():
+                msg = f"Some batches were not run because the hosts failed: {errors}."
+                raise RuntimeError(msg + f" Complete using `dispatch(resume={str(data_dir)!r})`.")
+        if not (reduce and (data_dir / "reduced").exists()):
+            warn_failures(data_dir)
+        catalog.finish(data_root, data_dir)
+        return data_dir
+    except BaseException as error:
+        failed = "interrupted" if isinstance(error, KeyboardInterrupt) else "failed"
+        catalog.register(data_root, data_dir, status=failed)
+        raise
+    finally:
+        savers.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    """Command line interface (the `xp` script), e.g. `xp ls method=X 'N>=1000'`. See `xp -h`."""
+    from .catalog import cli
+
+    cli(argv)
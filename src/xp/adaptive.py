@@ -0,0 +1,99 @@
+"""Adaptive (sequential) sweeps: replicate (i.e. seeds of) each configuration only until converged.
+
+Rather than running a fixed number of seeds for every configuration (group of xps that only
+differ by their seed), `sweep` runs them in rounds (of `dispatch`), where each round only adds
+seeds for the configurations whose statistic (e.g. the error) has not yet converged,
+i.e. the confidence interval of its mean (over the seeds) is not yet within the tolerance.
+"""
+
+import itertools
+import math
+import statistics
+
+# Quantiles (97.5%) of Student's t-distribution, by degrees of freedom (1, 2, ...). Beyond: normal.
+T975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228]
+T975 += [2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086]
+T975 += [2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def halfwidth(values):
+    """Half-width of the (95%) confidence interval of the mean of `values`."""
+    n = len(values)
+    if n < 2:
+        return math.inf
+    t = T975[n - 2] if n - 1 <= len(T975) else 1.96
+    return t * statistics.stdev(values) / math.sqrt(n)
+
+
+def results(data_dir):
+    """`{i: result}` for the xps of `data_dir` that have one (i.e. did not fail)."""
+    from . import manifest, store
+
+    offsets = manifest(data_dir)["offsets"]
+    res = data_dir / "res"
+    return {o + i: r for b, o in enumerate(offsets) for i, r in store.read(res / str(b))}
+
+
+def sweep(fun, xps, stat, tol, seeds, rtol=0, key="seed", nFirst=2, nRound=None, **kwargs):
+    """Run `fun` on `xps` × `seeds` in rounds, until `stat` converges for each of the `xps`.
+
+    - `xps`: the configurations (kwargs dicts, or `ParamSpace`), without `key`.
+      Those that do specify it (e.g. `seed=None` for a deterministic method) are run once.
+    - `stat(result)`: the statistic (a float), e.g. `lambda r: r["error"]`.
+    - Converged: (95%) confidence interval of the mean of `stat` within `±max(tol, rtol*|mean|)`.
+    - `seeds`: those available (i.e. the maximum number of replications), used in order.
+    - `nFirst`: seeds in the first round. The following rounds add `nRound` seeds (default:
+      as many as projected to converge, assuming the half-width `∝ 1/√n`, but at most doubling).
+
+    The `kwargs` are passed to `dispatch`. Returns the `xps` and `results` of all rounds.
+    """
+    from . import dispatch
+
+    configs = list(xps)
+    used = [0] * len(configs)  # seeds
+    values = [[] for _ in configs]  # of `stat`
+    todo = {i: 1 if key in cfg else nFirst for i, cfg in enumerate(configs)}  # number of seeds
+    all_xps, all_results = [], []
+
+    for r in itertools.count(1):
+        batch = []
+        for i, n in todo.items():
+            if key in configs[i]:
+                batch.append((i, configs[i]))
+            else:
+                batch += [(i, {**configs[i], key: s}) for s in seeds[used[i] : used[i] + n]]
+                used[i] += n
+        print(f"Round {r}: {len(batch)} xps, for {len(todo)} of {len(configs)} configurations.")
+        data_dir = dispatch(fun, [kw for _, kw in batch], **kwargs)
+        done = results(data_dir)
+        for j, (i, kw) in enumerate(batch):
+            if j in done:
+                all_xps.append(kw)
+                all_results.append(done[j])
+                values[i].append(stat(done[j]))
+
+        # Plan next round
+        todo_next, exhausted = {}, []
+        for i in todo:
+            if key in configs[i]:
+                continue
+            hw = halfwidth(values[i])
+            bound = max(tol, rtol * abs(statistics.fmean(values[i]))) if values[i] else tol
+            if hw <= bound:
+                continue
+            if used[i] >= len(seeds):
+                exhausted.append(i)
+                continue
+            n = len(values[i])
+            if nRound:
+                more = nRound
+            elif math.isfinite(hw) and bound > 0:
+                more = max(1, min(n, math.ceil(n * (hw / bound) ** 2) - n))
+            else:
+                more = max(1, n)
+            todo_next[i] = min(more, len(seeds) - used[i])
+        if exhausted:
+            print(f"Warning: {len(exhausted)} configuration(s) ran out of seeds before converging.")
+        todo = todo_next
+        if not todo:
+            return all_xps, all_results
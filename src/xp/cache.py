@@ -0,0 +1,69 @@
+"""Content-addressed storage of results, so that re-dispatching only computes new xps."""
+
+import hashlib
+import inspect
+import subprocess
+from pathlib import Path
+
+import dill
+
+
+def digest(obj) -> str:
+    """Stable hash of `obj` (via its pickle)."""
+    return hashlib.sha1(dill.dumps(obj)).hexdigest()
+
+
+def fun_version(fun, script: Path):
+    """Version of the code of `fun` (defined in `script`).
+
+    I.e. the git sha of the repo of `script`, with a hash of its uncommitted changes (if any),
+    else (no git) a hash of the source of `script` (or of `fun`).
+    """
+    from . import git_sha
+
+    repo = Path(script).expanduser().resolve().parent
+    try:
+        sha = git_sha(repo, short=False, check=False)
+    except FileNotFoundError:  # no git
+        sha = None
+    if sha:
+        cmd = ["git", "-C", str(repo), "diff", "HEAD"]
+        diff = subprocess.run(cmd, capture_output=True).stdout
+        return sha[:10] + (f"+{digest(diff)[:8]}" if diff else "")
+    try:
+        return digest(Path(script).read_text())[:10]
+    except OSError:
+        return digest(inspect.getsource(fun))[:10]
+
+
+class Cache:
+    """Results of `fun`, stored (one file each) by hash of their kwargs.
+
+    NB: Invalidated by changes to the code (see `fun_version`) of the repo of `script`,
+    incl. uncommitted ones, but NOT by (changes to) untracked files.
+    """
+
+    def __init__(self, root: Path, fun, script: Path):
+        name = f"{Path(script).stem}.{fun.__name__}@{fun_version(fun, script)}"
+        self.dir = Path(root) / name
+
+    def key(self, kwargs: dict):
+        # Sort ⇒ independent of order of kwargs
+        return digest(sorted(kwargs.items(), key=lambda kv: kv[0]))
+
+    def path(self, key):
+        return self.dir / key[:2] / key
+
+    def __contains__(self, key):
+        return self.path(key).exists()
+
+    def __getitem__(self, key):
+        return dill.loads(self.path(key).read_bytes())
+
+    def __setitem__(self, key, result):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to tmp, then rename ⇒ atomic (no partial entries)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(dill.dumps(result))
+        tmp.rename(path)
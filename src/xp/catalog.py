@@ -0,0 +1,224 @@
+"""Catalog (index) of the runs (`data_dir`s) under `data_root`, in SQLite (`data_root/catalog.db`).
+
+`dispatch` registers each run with its timestamp, git sha, hosts, batch layout, status,
+and a summary of the parameters of its xps (the distinct scalar values of each key).
+Hence runs can be looked up (see `query`, or `xp ls` on the command line)
+without scanning directories or loading xps. Runs made before the catalog: see `index`.
+"""
+
+import argparse
+import ast
+import json
+import re
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime
+from pathlib import Path
+
+FILE = "catalog.db"
+MAX_VALUES = 1000  # per key. If more, only the min and max are recorded.
+COLUMNS = ["path", "proj", "script", "fun", "created", "sha", "hosts"]
+COLUMNS += ["nXp", "nBatch", "nCPU", "status", "updated"]
+NUMERIC = ["nXp", "nBatch", "nCPU"]
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs ({", ".join(COLUMNS)}, PRIMARY KEY (path));
+CREATE TABLE IF NOT EXISTS params (run, key, value, UNIQUE (run, key, value));
+CREATE INDEX IF NOT EXISTS params_kv ON params (key, value);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+"""
+CONDITION = re.compile(r"(\w+)\s*(==|!=|>=|<=|=|>|<)\s*(.*)")
+
+
+@contextmanager
+def connect(data_root: Path):
+    """Connection (in a transaction) to the catalog of `data_root`."""
+    data_root = Path(data_root).expanduser()
+    data_root.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(data_root / FILE, timeout=60)) as con:
+        with con:
+            con.executescript(SCHEMA)
+            con.row_factory = sqlite3.Row
+            yield con
+
+
+def _scalar(v):
+    if hasattr(v, "item") and getattr(v, "ndim", None) == 0:  # numpy scalar
+        v = v.item()
+    return v if v is None or isinstance(v, (bool, int, float, str)) else ...
+
+
+def summary(xps):
+    """The distinct (scalar, i.e. searchable) values of each parameter (key) of `xps`."""
+    from .params import ParamSpace
+
+    if isinstance(xps, ParamSpace):
+        import numpy as np
+
+        # NB: only the values in use (the tables are kept intact by `filter`, slicing, ...)
+        values = {}
+        for j, (k, vs) in enumerate(xps.values.items()):
+            used = np.unique(xps.codes[:, j])
+            values[k] = {_scalar(vs[c]) for c in used[used >= 0]}
+    else:
+        values = {}
+        for kwargs in xps:
+            for k, v in kwargs.items():
+                values.setdefault(k, set()).add(_scalar(v))
+    out = {}
+    for k, vs in values.items():
+        vs.discard(...)
+        if len(vs) > MAX_VALUES:
+            try:
+                vs = {min(vs), max(vs)}
+            except TypeError:  # mixed types
+                vs = set()
+        out[k] = sorted(vs, key=lambda v: (type(v).__name__, v if v is not None else 0))
+    return out
+
+
+def status(data_dir: Path):
+    """`"done"`, or `"incomplete"` (some results missing, e.g. failed xps)."""
+    from . import incomplete
+
+    return "done" if (data_dir / "reduced").exists() or not incomplete(data_dir) else "incomplete"
+
+
+def register(data_root: Path, data_dir: Path, xps=None, **fields):
+    """Add/update (the `fields` of) run `data_dir`. Also record the `summary` of `xps`, if given."""
+    data_root = Path(data_root).expanduser()
+    path = Path(data_dir).expanduser().relative_to(data_root)
+    now = datetime.now().isoformat(timespec="seconds")
+    row = dict(path=str(path), proj=path.parts[0], script=path.parts[1], created=now)
+    row |= dict(fields, updated=now)
+    cols = ", ".join(row)
+    marks = ", ".join("?" * len(row))
+    # NB: `created` is only set upon insertion (unless given)
+    update = ", ".join(f"{c} = excluded.{c}" for c in row if c != "created" or c in fields)
+    with connect(data_root) as con:
+        sql = f"INSERT INTO runs ({cols}) VALUES ({marks})"
+        con.execute(f"{sql} ON CONFLICT (path) DO UPDATE SET {update}", list(row.values()))
+        if xps is not None:
+            con.execute("DELETE FROM params WHERE run = ?", [row["path"]])
+            rows = [(row["path"], k, v) for k, vs in summary(xps).items() for v in vs]
+            con.executemany("INSERT OR IGNORE INTO params VALUES (?, ?, ?)", rows)
+
+
+def finish(data_root: Path, data_dir: Path):
+    """Update the `status` of run `data_dir`, once its dispatch is over."""
+    register(data_root, data_dir, status=status(Path(data_dir)))
+
+
+def parse(condition):
+    """Parse `"key<op>value"`, e.g. `"N>=1000"`, into `(key, op, value)`.
+
+    The value is a Python literal (e.g. `1000`, `True`, `None`, `'1e3'`), else a `str`,
+    except for the (textual) columns of runs (e.g. `sha`, `created`), where it's always a `str`.
+    """
+    if not (match := CONDITION.fullmatch(condition.strip())):
+        raise ValueError(f"Invalid condition {condition!r}, should be like 'N>=1000'.")
+    key, op, value = match.groups()
+    if key not in COLUMNS or key in NUMERIC:
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass  # ⇒ str
+    return key, op, value
+
+
+def query(data_root: Path, *conditions, limit=None, params=False, **equals):
+    """Runs (dicts, latest first) under `data_root` satisfying all `conditions` (and `equals`).
+
+    Conditions on a parameter are satisfied if any of the xps of the run satisfies it.
+    Example: `query("~/data", "method=X", "N>=1000", sha="abc1234")`. NB: `sha` matches by prefix.
+    A condition is a string (see `parse`) or a tuple `(key, op, value)`.
+    The latest run of a script: `query(data_root, proj="P", script="S", limit=1)`.
+    If `params`, each run also gets the `summary` of its xps.
+    """
+    data_root = Path(data_root).expanduser()
+    conditions = [parse(c) if isinstance(c, str) else c for c in conditions]
+    conditions += [(k, "=", v) for k, v in equals.items()]
+    where, args = [], []
+    for key, op, value in conditions:
+        op = {"==": "IS", "=": "IS", "!=": "IS NOT"}.get(op, op) if value is None else op
+        if key == "sha" and op in ["=", "=="]:
+            where.append("runs.sha LIKE ? || '%'")
+            args.append(value)
+        elif key in COLUMNS:
+            where.append(f"runs.{key} {op} ?")
+            args.append(value)
+        else:
+            exists = "SELECT 1 FROM params WHERE run = runs.path AND key = ? AND value {} ?"
+            where.append(f"EXISTS ({exists.format(op)})")
+            args += [key, value]
+    sql = "SELECT * FROM runs" + (" WHERE " + " AND ".join(where) if where else "")
+    sql += " ORDER BY created DESC" + (f" LIMIT {int(limit)}" if limit else "")
+    if not (data_root / FILE).exists():
+        return []
+    with connect(data_root) as con:
+        runs = [dict(row) for row in con.execute(sql, args)]
+        for run in runs:
+            if params:
+                sql = "SELECT key, value FROM params WHERE run = ? ORDER BY rowid"
+                rows = con.execute(sql, [run["path"]])
+                run["params"] = {}
+                for key, value in rows:
+                    run["params"].setdefault(key, []).append(value)
+            run["path"] = str(data_root / run["path"])
+    return runs
+
+
+def index(data_root: Path):
+    """Register the runs under `data_root` that are not (yet) in the catalog. Return how many."""
+    from . import load_batches, manifest, timestamp
+
+    data_root = Path(data_root).expanduser()
+    known = {run["path"] for run in query(data_root)}
+    n = 0
+    for data_dir in sorted(p.parent for p in data_root.glob("*/*/*/xps")):
+        if str(data_dir) in known:
+            continue
+        try:
+            created = datetime.strptime(data_dir.name, timestamp)
+        except ValueError:
+            created = datetime.fromtimestamp(data_dir.stat().st_mtime)
+        try:
+            xps = load_batches(data_dir, "xps")
+            nBatch = len(manifest(data_dir)["counts"])
+            state = status(data_dir)
+        except Exception as error:
+            print(f"Warning: could not index {data_dir} ({error!r}).")
+            continue
+        fields = dict(created=created.isoformat(timespec="seconds"), status=state)
+        register(data_root, data_dir, xps, nXp=len(xps), nBatch=nBatch, **fields)
+        n += 1
+    return n
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog="xp", description="Catalog of the runs of `dispatch`.")
+    parser.add_argument("--root", default="~/data", help="The `data_root` (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ls = sub.add_parser("ls", help="List runs (latest first)")
+    ls.add_argument("conditions", nargs="*", help="e.g. method=X 'N>=1000' sha=abc1234")
+    ls.add_argument("-n", "--limit", type=int, help="Max number of runs to list")
+    ls.add_argument("-v", "--verbose", action="store_true", help="Also show the parameters")
+    ls.add_argument("--json", action="store_true", help="Print JSON lines")
+    sub.add_parser("index", help="Register the runs that are not in the catalog")
+    args = parser.parse_args(argv)
+
+    if args.command == "index":
+        print(f"Indexed {index(args.root)} run(s).")
+        return
+    runs = query(args.root, *args.conditions, limit=args.limit, params=args.verbose)
+    for run in runs:
+        if args.json:
+            print(json.dumps(run))
+            continue
+        sha = (run["sha"] or "-")[:8]
+        print(
+            f"{run['created'] or '?':<19}  {run['status'] or '?':<10}  {sha:<8}",
+            f"{run['nXp'] or 0:>8} xps  {run['hosts'] or '-'}  {run['path']}",
+        )
+        for key, values in run.get("params", {}).items():
+            shown = ", ".join(map(repr, values[:8])) + (", ..." if len(values) > 8 else "")
+            print(f"    {key}: {shown}")
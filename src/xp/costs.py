@@ -0,0 +1,118 @@
+"""Estimate the cost (runtime) of xps, for longest-first scheduling (see `local_mp.lpt_chunks`)."""
+
+import math
+from pathlib import Path
+
+import numpy as np
+
+from . import serial, store
+
+BACKFIT_ITERS = 10
+
+
+def timings(data_dir: Path, key="wall"):
+    """Yield `(kwargs, wall)` for the xps of `data_dir` whose wall time (or `key`) got recorded."""
+    if not (data_dir / "stats").is_dir():
+        return
+    for path in (data_dir / "stats").iterdir():
+        xps = serial.load(data_dir / "xps" / path.name)
+        for i, stats in store.read(path):
+            if key in stats:
+                yield xps[i], stats[key]
+
+
+class CostModel:
+    """Additive model of `log(wall)` over the parameter values (i.e. multiplicative effects).
+
+    Also usable for other (positive) quantities, e.g. the peak RSS (see `pilot`).
+
+    Numeric values not seen in training get their effect interpolated (in log-log),
+    e.g. for `N=10_000` from the timings of `N=100` and `N=1000`.
+    """
+
+    def __init__(self, samples):
+        samples = [(kw, math.log(max(wall, 1e-9))) for kw, wall in samples]
+        self.mean = np.mean([y for _, y in samples])
+        groups = {}
+        rows = []  # (hashable) key-value pairs, and deviation, of each sample
+        for kw, y in samples:
+            pairs = []
+            for key, val in kw.items():
+                try:
+                    groups.setdefault(key, {}).setdefault(val, []).append(y - self.mean)
+                except TypeError:  # unhashable
+                    continue
+                pairs.append((key, val))
+            rows.append((pairs, y - self.mean))
+        groups = {k: g for k, g in groups.items() if _informative(g, len(samples))}
+        self.effects = {k: {v: np.mean(ys) for v, ys in g.items()} for k, g in groups.items()}
+
+        # Refine by backfitting, since (e.g. pilot) samples are generally not balanced
+        rows = [([(k, v) for k, v in pairs if k in groups], y) for pairs, y in rows]
+        for _ in range(BACKFIT_ITERS):
+            for key, effects in self.effects.items():
+                residuals = {}
+                for pairs, y in rows:
+                    others = sum(self.effects[k][v] for k, v in pairs if k != key)
+                    for k, v in pairs:
+                        if k == key:
+                            residuals.setdefault(v, []).append(y - others)
+                effects.update({v: np.mean(rs) for v, rs in residuals.items()})
+
+    @classmethod
+    def learn(cls, root: Path, nRuns=5):
+        """Fit on the timings of the latest `nRuns` (dispatches) in `root`."""
+        runs = sorted(d for d in root.iterdir() if (d / "stats").is_dir())[-nRuns:]
+        samples = [s for run in runs for s in timings(run)]
+        return cls(samples) if samples else None
+
+    def effect(self, key, val):
+        effects = self.effects.get(key, {})
+        try:
+            return effects[val]
+        except (KeyError, TypeError):
+            pass
+        # Interpolate numeric values
+        known = sorted((v, e) for v, e in effects.items() if _positive(v))
+        if not _positive(val) or not known:
+            return 0
+        x, y = np.log([v for v, _ in known]), [e for _, e in known]
+        if len(known) == 1:
+            return y[0]
+        i = np.clip(np.searchsorted(x, np.log(val)), 1, len(x) - 1)
+        slope = (y[i] - y[i - 1]) / (x[i] - x[i - 1])
+        return y[i - 1] + slope * (np.log(val) - x[i - 1])
+
+    def __call__(self, kwargs):
+        return math.exp(self.mean + sum(self.effect(k, v) for k, v in kwargs.items()))
+
+    def predict(self, xps):
+        """Costs (array) of all `xps`. For a `ParamSpace`, vectorized over its codes."""
+        from .params import ParamSpace
+
+        if not isinstance(xps, ParamSpace):
+            return np.array([self(kwargs) for kwargs in xps], dtype=float)
+        logs = np.full(len(xps), self.mean)
+        for j, (key, vals) in enumerate(xps.values.items()):
+            table = np.array([self.effect(key, v) for v in vals] + [0.0])  # [-1] ⇒ absent
+            logs += table[xps.codes[:, j]]
+        return np.exp(logs)
+
+
+def _informative(group, nSamples):
+    """Whether the effects of the values of a key are not just noise.
+
+    If most of its values only occur once (e.g. seeds), then they must follow a trend (in log-log).
+    """
+    if len(group) <= nSamples / 2:
+        return True
+    pts = [(math.log(v), y) for v, ys in group.items() if _positive(v) for y in ys]
+    if len(pts) < 3:
+        return len(pts) == len(group)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.corrcoef(*zip(*pts))[0, 1]
+    return r**2 >= 0.5
+
+
+def _positive(v):
+    return isinstance(v, (int, float, np.number)) and not isinstance(v, bool) and v > 0
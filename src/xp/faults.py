@@ -0,0 +1,66 @@
+"""Per-xp fault isolation: capture (and retry) the failures of xps, rather than failing the batch.
+
+The failures get recorded (by `launch_xps.py`) in `data_dir/fail/`, see `xp.failures`.
+"""
+
+import os
+import signal
+import time
+import traceback
+
+import dill
+
+
+class Failure:
+    """Returned (instead of `result, stats`) for an xp that failed all of its attempts."""
+
+    def __init__(self, record):
+        self.record = record  # type, error, traceback, attempts, wall
+
+
+def call(job, kwargs):
+    """Return `("ok", job(kwargs))`, or `("error", record)`."""
+    try:
+        return "ok", job(kwargs)
+    except Exception as error:
+        tb = traceback.format_exc()
+        return "error", dict(type=type(error).__name__, error=repr(error), traceback=tb)
+
+
+def call_forked(job, kwargs):
+    """Like `call`, but in a forked process ⇒ also survives segfaults (etc) of `job`.
+
+    NB: uses `os.fork` directly, since `multiprocessing` workers may not have children.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # child
+        os.close(r)
+        try:
+            with os.fdopen(w, "wb") as f:
+                f.write(dill.dumps(call(job, kwargs)))
+        finally:
+            os._exit(0)
+    os.close(w)
+    with os.fdopen(r, "rb") as f:
+        payload = f.read()
+    _, status = os.waitpid(pid, 0)
+    if payload:
+        return dill.loads(payload)
+    if os.WIFSIGNALED(status):
+        error = f"Killed by {signal.Signals(os.WTERMSIG(status)).name}"
+    else:
+        error = f"Exited with code {os.waitstatus_to_exitcode(status)}"
+    return "error", dict(type="ChildProcessError", error=error, traceback="")
+
+
+def guard(job, kwargs, retries=0, isolate=False):
+    """Run `job(kwargs)`, retrying up to `retries` times. Return its output, or a `Failure`."""
+    t0 = time.perf_counter()
+    for attempt in range(1 + retries):
+        status, output = (call_forked if isolate else call)(job, kwargs)
+        if status == "ok":
+            if attempt:
+                output[1]["attempts"] = 1 + attempt  # `stats` of `instrument.measure`
+            return output
+    return Failure(dict(output, attempts=1 + retries, wall=time.perf_counter() - t0))
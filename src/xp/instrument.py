@@ -0,0 +1,107 @@
+"""Measure the resources used by each xp (recorded in `stats/`, next to `res/`), and profile them.
+
+Example record: `{"wall": 2.1, "cpu": 2.0, "rss": 81264640, "pid": 4242, "host": "my-gcp-1"}`
+"""
+
+import os
+import resource
+import socket
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+HOST = socket.gethostname()
+
+
+def reset_peak_rss():
+    """Reset the peak RSS ("high water mark") of this process. Linux only."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def rss():
+    """Current RSS (bytes) of this process. Linux only (else `None`)."""
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss():
+    """Peak RSS (bytes) since `reset_peak_rss` (else, of the lifetime of this process)."""
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def mem_available():
+    """Available memory (bytes) of this machine. Linux only (else `None`)."""
+    try:
+        for line in Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def cprofile(path):
+    """Default `profiler`. Inspect the result with e.g. `snakeviz` or `pstats`."""
+    import cProfile
+
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
+
+
+def measure(fun, kwargs, full=False, profile=None, profiler=cprofile, dir_prof=None):
+    """Run `fun(**kwargs)`. Return `result, stats`.
+
+    The `stats` only contain `wall` time, unless `full`. If `profile(kwargs)`,
+    then the xp is run within the context manager `profiler(path)`, with `path` in `dir_prof`.
+    """
+    stats = {}
+    if full:
+        reset_peak_rss()
+        cpu0 = time.process_time()
+
+    if profile and profile(kwargs):
+        from .cache import digest
+
+        Path(dir_prof).mkdir(exist_ok=True)
+        path = Path(dir_prof) / digest(sorted(kwargs.items()))
+        stats["prof"] = f"prof/{path.name}"  # relative to `data_dir`
+        ctx = profiler(path)
+    else:
+        ctx = None
+
+    t0 = time.perf_counter()
+    if ctx is None:
+        result = fun(**kwargs)
+    else:
+        with ctx:
+            result = fun(**kwargs)
+    stats["wall"] = time.perf_counter() - t0
+
+    if full:
+        stats["cpu"] = time.process_time() - cpu0
+        stats["rss"] = peak_rss()
+        stats["pid"] = os.getpid()
+        stats["host"] = HOST
+    return result, stats
@@ -1,29 +1,210 @@
-"""Run `fun_name` (from `script`) using `nCPU`, but first: load xps. Last: Save results."""
+"""Run `fun_name` (from `script`) using `nCPU`, but first: load xps. Save results as they come.
+
+Results already in the store (e.g. from an interrupted run) are not re-computed.
+With `--progress`, progress events (for `dispatch`) replace the progress bar.
+If `dir_xps` is `-`, then keep serving the batches whose paths get written to stdin,
+reusing the same (warm) process pool, thus skipping the startup (and import) costs,
+and without draining it between batches (see `serve`).
+"""
 # NOTE: This file *imports* `script` and invokes the `fun` defined therein.
 # But want to support "standalone" scripts, i.e. run as `python path/to/{script}`.
 # ⇒ This file must get copied into `to/` or insert `to/` in `sys.path`.
 # For remote work, we need to do the copy anyways, let's choose the copy solution.
 
+import queue
 import sys
+import threading
+import traceback
+from contextlib import ExitStack
+from functools import partial
 from importlib import import_module
 from pathlib import Path
 
 import dill
 
-from xp.local_mp import mp
+from xp import faults, instrument, progress, serial, store
+from xp.local_mp import chunked, imap_chunks, layout, limited, mp_iter
+
+
+class Batch:
+    """The xps (yet to be run) of the batch at `dir_xps`, and the writers of their outputs."""
+
+    def __init__(self, dir_xps, report=False):
+        self.dir_xps = dir_xps = Path(dir_xps).expanduser()
+        self.name = dir_xps.name
+        self.report = report
+        self.events = None
+        xps = serial.load(dir_xps)
+
+        dir_res = Path(str(dir_xps).replace("/xps/", "/res/"))
+        done = store.done(dir_res)
+        self.todo = [i for i in range(len(xps)) if i not in done]
+        if done and not report:
+            print(f"Resuming: {len(done)} of {len(xps)} xp's already done.")
+
+        # Cost estimates (by `dispatch`) ⇒ longest-first scheduling
+        dir_costs = Path(str(dir_xps).replace("/xps/", "/costs/"))
+        self.costs = None
+        if dir_costs.exists():
+            costs = serial.load(dir_costs)
+            self.costs = [costs[i] for i in self.todo]
+
+        # Timings (for estimating costs of future dispatches), and failures
+        dir_stats = Path(str(dir_xps).replace("/xps/", "/stats/"))
+        dir_fail = Path(str(dir_xps).replace("/xps/", "/fail/"))
+        for d in [dir_stats, dir_fail]:
+            d.parent.mkdir(exist_ok=True)
+
+        # Options (by `dispatch`)
+        opts = dir_xps.parents[1] / "opts"
+        self.opts = opts = dill.loads(opts.read_bytes()) if opts.exists() else {}
+        dir_prof = dir_xps.parents[1] / "prof"
+        job = partial(instrument.measure, fun, dir_prof=dir_prof, **opts.get("measure", {}))
+        if opts.get("guard") is not None:
+            job = partial(faults.guard, job, **opts["guard"])
+        self.job = job
+
+        # res = [fun(xp) for xp in xps]  # -- for debugging --
+        # NB: `ParamSpace` (not imported here, to keep startup fast) materializes kwargs on the fly
+        self.xps = [xps[i] for i in self.todo] if isinstance(xps, list) else xps[self.todo]
+        self.left = len(self.todo)
+
+        self.writers = ExitStack()
+        self.res = self.writers.enter_context(store.Writer(dir_res, opts.get("codec")))
+        self.stats = self.writers.enter_context(store.Writer(dir_stats))
+        self.fails = self.writers.enter_context(store.Writer(dir_fail))
+        if report:
+            self.events = progress.Emitter(self.name, len(xps), len(done))
+
+    def record(self, j, output):
+        """Write the `output` (of `job`) of the `j`-th of the `xps`."""
+        self.left -= 1
+        if isinstance(output, faults.Failure):
+            self.fails.append(self.todo[j], output.record)
+            if self.events:
+                self.events.update(output.record["wall"], failed=True)
+            else:
+                print(f"xp {self.todo[j]} failed: {output.record['error']}")
+            return
+        result, xp_stats = output
+        self.res.append(self.todo[j], result)
+        self.stats.append(self.todo[j], xp_stats)
+        if self.events:
+            self.events.update(xp_stats["wall"])
+
+    def close(self, error=None):
+        self.writers.close()
+        if self.events:
+            self.events.close(error)
+        elif self.report and error:
+            progress.emit(batch=self.name, end=True, error=repr(error))
+
+
+def run(dir_xps, nCPU, report=False):
+    batch = None
+    try:
+        batch = Batch(dir_xps, report)
+        kws = dict(quiet=report, cost=batch.costs, ordered=False, **batch.opts.get("mp", {}))
+        for j, output in mp_iter(batch.job, batch.xps, nCPU, **kws):
+            batch.record(j, output)
+    except BaseException as error:
+        if batch:
+            batch.close(error)
+        elif report:
+            progress.emit(batch=Path(dir_xps).name, end=True, error=repr(error))
+        raise
+    batch.close()
+
+
+def caught(job, kwargs):
+    """`(True, job(kwargs))`, or `(False, error)` ⇒ only its batch fails (not the stream)."""
+    try:
+        return True, job(kwargs)
+    except Exception as error:
+        traceback.print_exc()
+        return False, error
+
+
+def serve(lines, nCPU):
+    """Run the batches whose paths come in `lines` (e.g. stdin), as a single stream of xps.
+
+    Thus the pool is kept busy across batches: the next batch (if it has already been received)
+    fills the CPUs left idle by the stragglers of the previous one.
+    NB: The (`mp`) options are those of the first batch.
+    """
+    paths = queue.Queue()
+    batches = {}  # started, but not done
+
+    def read():
+        for line in lines:
+            paths.put(line.strip())
+        paths.put(None)
+
+    def load(path):
+        try:
+            batch = Batch(path, report=True)
+        except Exception as error:
+            traceback.print_exc()
+            progress.emit(batch=Path(path).name, end=True, error=repr(error))
+            return None
+        if not batch.left:
+            batch.close()
+            return None
+        batches[batch.name] = batch
+        return batch
+
+    threading.Thread(target=read, daemon=True).start()
+    first = None
+    while first is None:
+        if (path := paths.get()) is None:
+            return
+        first = load(path)
+    opts = dict(first.opts.get("mp", {}))
+    nWorkers, threads = layout(nCPU, opts.pop("threads", None))
+    job = partial(limited, partial(caught, first.job), threads)
+
+    def chunks():  # NB: might be iterated in a thread (of the pool)
+        batch = first
+        while True:
+            if batch:
+                for chunk in chunked(batch.xps, nWorkers, batch.costs):
+                    yield [((batch.name, j), kwargs) for j, kwargs in chunk]
+            try:
+                path = paths.get(timeout=0.1)
+            except queue.Empty:
+                batch = None
+                yield None  # i.e. none yet
+                continue
+            if path is None:
+                return
+            batch = load(path)
+
+    try:
+        for (name, j), (ok, output) in imap_chunks(job, chunks(), nWorkers, **opts):
+            if not (batch := batches.get(name)):
+                continue  # failed
+            if not ok:
+                batches.pop(name).close(output)
+                continue
+            batch.record(j, output)
+            if not batch.left:
+                batches.pop(name).close()
+    except BaseException as error:
+        for batch in list(batches.values()):
+            batch.close(error)
+        raise
+
 
 if __name__ == "__main__":
     # Unpack arguments
-    _, script, fun_name, dir_xps, nCPU = sys.argv
+    _, script, fun_name, dir_xps, nCPU, *flags = sys.argv
     nCPU = None if nCPU == "None" else int(nCPU)
 
     fun = getattr(import_module(script), fun_name)
 
-    dir_xps = Path(dir_xps).expanduser()
-    xps = dill.loads(dir_xps.read_bytes())
-
-    # res = [fun(xp) for xp in xps]  # -- for debugging --
-    results = mp(lambda kwargs: fun(**kwargs), xps, nCPU)
-
-    dir_res = Path(str(dir_xps).replace("/xps/", "/res/"))
-    dir_res.write_bytes(dill.dumps(results))
+    if dir_xps == "-":
+        # NB: Not `sys.stdin`, whose lock (held by the reader thread) would be inherited by
+        # forked workers, which close `sys.stdin` upon start ⇒ deadlock.
+        serve(open(sys.stdin.fileno(), closefd=False), nCPU)
+    else:
+        run(dir_xps, nCPU, report="--progress" in flags)
@@ -1,26 +1,282 @@
-import pathos.multiprocessing as MP
-import threadpoolctl
-from tqdm.auto import tqdm
+"""Multiprocessing (`pathos`) with progress bar (`tqdm`).
+
+NB: `pathos` and `tqdm` are imported upon use (they are slow to import),
+and so is `threadpoolctl`, whose limits thereby also apply to BLAS libs loaded since import.
+"""
+
+import os
+from collections import deque
+from functools import partial
 
 bar_frmt = "{l_bar}|{bar}| {n_fmt}/{total_fmt}, ⏱️ {elapsed} ⏳{remaining}, {rate_fmt}{postfix}"
-threadpoolctl.threadpool_limits(1)  # make np use only 1 core
+BACKENDS = ["process", "thread"]
+_blas = None  # BLAS threads limit of this (worker) process
 
 
 def progbar(*args, **kwargs):
+    from tqdm.auto import tqdm
+
     return tqdm(*args, bar_format=bar_frmt, **kwargs)
 
 
-def mp(f, lst, nCPU=None):
-    """Multiprocessing map with progress bar."""
+def cpu_count():
+    """Number of CPUs available to this process (e.g. per `taskset` or SLURM)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS, Windows
+        return os.cpu_count()
+
+
+def layout(nCPU=None, threads=None, n=None):
+    """Split `nCPU` into `(nWorkers, threads)`: workers with (up to) `threads` BLAS threads each.
+
+    Default (`threads=None`): 1 thread per worker, unless there are fewer (`n`) items than CPUs,
+    in which case the CPUs are shared out among them. Either way, `nWorkers * threads <= nCPU`.
+    """
     if nCPU in [None, "all"] or nCPU is True:
-        nCPU = MP.cpu_count()
+        nCPU = cpu_count()
+    nCPU = max(1, nCPU or 1)
+    if threads is None:
+        threads = max(1, nCPU // n) if n else 1
+    threads = min(threads, nCPU)
+    return max(1, min(nCPU // threads, n or nCPU)), threads
+
+
+def limited(f, threads, x):
+    """Run `f(x)` with (at most) `threads` BLAS threads. The limit is set once per process."""
+    global _blas
+    if _blas != threads:
+        import threadpoolctl
+
+        threadpoolctl.threadpool_limits(threads)
+        _blas = threads
+    return f(x)
+
+
+def mp(f, lst, nCPU=None, quiet=False, cost=None, chunksize=None, **kwargs):
+    """Multiprocessing map with progress bar. The `kwargs` are those of `mp_iter`."""
+    return list(mp_iter(f, lst, nCPU, quiet, cost, chunksize=chunksize, **kwargs))
+
 
-    if nCPU in [0, 1, False]:
+def lpt_chunks(costs, nCPU):
+    """Chunks of indices in "longest processing time first" order.
+
+    The chunks are sized to have (roughly) equal cost ⇒ expensive items go alone,
+    while cheap items get bunched together (to amortize the overhead of each chunk).
+    """
+    order = sorted(range(len(costs)), key=lambda i: -costs[i])
+    target = sum(costs) / nCPU / 10  # heuristic, cf. chunksize below
+    chunk, acc = [], 0
+    for i in order:
+        chunk.append(i)
+        acc += costs[i]
+        if acc >= target:
+            yield chunk
+            chunk, acc = [], 0
+    if chunk:
+        yield chunk
+
+
+def chunked(lst, nWorkers, cost=None, chunksize=None):
+    """Chunks (lists of `(i, x)`) of `lst`, by `chunksize`, or by `cost` (see `lpt_chunks`)."""
+    if cost is None:
+        D = chunksize or 1 + len(lst) // nWorkers // 10  # heuristic chunksize
+        items = list(enumerate(lst))
+        return [items[a : a + D] for a in range(0, len(items), D)]
+    costs = [cost(x) for x in lst] if callable(cost) else list(cost)
+    return [[(i, lst[i]) for i in chunk] for chunk in lpt_chunks(costs, nWorkers)]
+
+
+def imap_chunks(f, chunks, nWorkers, backend="process", mem=None, maxtasks=None):
+    """Yield `(i, f(x))` for the `(i, x)` of the `chunks`, in order of completion.
+
+    The `chunks` may be a stream (e.g. of several batches), yielding `None` while waiting for more
+    (rather than blocking for long). Either way, the pool is kept busy until they run out.
+    """
+    if nWorkers == 1:
         # Use this for debugging
-        jobs = map(f, lst)
-    else:
+        yield from ((i, f(x)) for chunk in chunks if chunk is not None for i, x in chunk)
+        return
+    if mem or maxtasks:
+        if backend != "process":
+            raise ValueError("Workers can only be recycled with `backend='process'`.")
+        yield from recycling(f, chunks, nWorkers, mem, maxtasks)
+        return
+
+    import pathos.multiprocessing as MP
+    from pathos.threading import ThreadPool
+
+    Pool = MP.ProcessPool if backend == "process" else ThreadPool
+    chunks = (chunk for chunk in chunks if chunk is not None)  # NB: iterated by the pool
+    with Pool(nWorkers) as pool:
+        done = pool.uimap(lambda chunk: [(i, f(x)) for i, x in chunk], chunks)
+        for chunk in done:
+            yield from chunk
+
+
+def _work(f, conn):
+    """Loop of a `recycling` worker: run the chunks received on `conn`, until sent `None`."""
+    from .instrument import peak_rss, rss
+
+    while (chunk := conn.recv()) is not None:
+        try:
+            out = True, [(i, f(x)) for i, x in chunk]
+        except Exception as error:
+            out = False, error
+        conn.send((*out, rss() or peak_rss(), peak_rss()))
+
+
+def recycling(f, chunks, nWorkers, mem=None, maxtasks=None):
+    """Yield `(i, f(x))` for the `(i, x)` of the `chunks`, run by (up to) `nWorkers` processes.
+
+    A worker gets recycled (i.e. replaced by a fresh process) after `maxtasks` chunks,
+    or once its RSS exceeds `mem` (bytes), e.g. because `f` leaks.
+    The number of (live) workers is throttled so that the workers' RSS (the largest one observed,
+    or `mem` until then) times their number does not exceed the available memory.
+    A worker that dies (e.g. killed by the OOM killer) has its chunk re-run (once),
+    and lowers the maximum number of workers.
+    The `chunks` may be a stream, see `imap_chunks`.
+    """
+    import multiprocess as MP
+    from multiprocess.connection import wait
+
+    from .instrument import mem_available
+
+    chunks = iter(chunks)
+    retry = deque()  # chunks of dead workers
+    retried = set()  # (the first index of) those re-run
+    workers = []  # live (dicts)
+    peak = 0  # largest RSS of a worker (so far)
+
+    def spawn():
+        conn, child = MP.Pipe()
+        proc = MP.Process(target=_work, args=(f, child), daemon=True)
+        proc.start()
+        child.close()  # ⇒ `EOFError` (rather than hanging) if the worker dies
+        workers.append(dict(proc=proc, conn=conn, chunk=None, tasks=0, rss=0))
+        return workers[-1]
+
+    def retire(w):
+        workers.remove(w)
+        w["conn"].send(None)
+        w["proc"].join()
+        w["conn"].close()
+
+    def limit():
+        avail, per_worker = mem_available(), max(peak, mem or 0)
+        if not (avail and per_worker):
+            return nWorkers
+        avail += sum(w["rss"] for w in workers)  # that is, if they were all retired
+        return max(1, min(nWorkers, int(avail // per_worker)))
+
+    exhausted = False
+    try:
+        while True:
+            n, starved = limit(), False
+            idle = [w for w in workers if w["chunk"] is None]
+            for w in idle[: max(0, len(workers) - n)]:
+                retire(w)
+                idle.remove(w)
+            while idle or len(workers) < n:
+                chunk = retry.popleft() if retry else next(chunks, ...)
+                exhausted, starved = chunk is ..., chunk is None
+                if exhausted or starved:
+                    break
+                w = idle.pop() if idle else spawn()
+                w["conn"].send(chunk)
+                w["chunk"] = chunk
+            if exhausted:
+                for w in idle:
+                    retire(w)
+                if not workers:
+                    return
+
+            # If starved (i.e. waiting for the stream of chunks), check back shortly
+            for conn in wait([w["conn"] for w in workers], 0.1 if starved else None):
+                w = next(w for w in workers if w["conn"] is conn)
+                try:
+                    ok, out, w["rss"], hwm = conn.recv()
+                except EOFError:
+                    workers.remove(w)
+                    w["proc"].join()
+                    if (first := w["chunk"][0][0]) in retried:
+                        code = w["proc"].exitcode
+                        raise RuntimeError(f"Worker died (exit code {code}), twice on a chunk.")
+                    retried.add(first)
+                    retry.append(w["chunk"])
+                    nWorkers = max(1, len(workers))
+                    continue
+                if not ok:
+                    raise out
+                peak = max(peak, hwm)
+                w["chunk"] = None
+                w["tasks"] += 1
+                yield from out
+                if (maxtasks and w["tasks"] >= maxtasks) or (mem and w["rss"] > mem):
+                    retire(w)
+    finally:
+        for w in workers:
+            w["proc"].terminate()
+
+
+def mp_iter(
+    f,
+    lst,
+    nCPU=None,
+    quiet=False,
+    cost=None,
+    ordered=True,
+    chunksize=None,
+    threads=None,  # BLAS threads per worker. Default: see `layout`
+    backend="process",  # or "thread"
+    mem=None,  # Memory budget (bytes) per worker. See `recycling`
+    maxtasks=None,  # Recycle workers after this many chunks. See `recycling`
+):
+    """Like `mp`, but yields the results as they come.
+
+    If `cost` (a list, or a callable on each item) is given, the items are scheduled
+    longest-first, in chunks of similar cost (see `lpt_chunks`).
+    Unless `ordered`, yields `(index, result)` in order of completion.
+
+    The `nCPU` are split (see `layout`) into workers × `threads`, i.e. processes
+    (or threads, if `backend="thread"`) each running BLAS (numpy, scipy) with `threads` threads.
+    Threads avoid the (pickling) overhead of processes, but only pay off if `f` releases the GIL
+    (e.g. numba `nogil` or BLAS-heavy code). NB: the BLAS limit of the threads is shared.
+
+    With `mem` or `maxtasks`, the processes are managed by `recycling` (rather than `pathos`),
+    which also throttles their number (memory permitting).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}. Use one of {BACKENDS}.")
+    nWorkers, threads = layout(nCPU, threads, len(lst))
+    f = partial(limited, f, threads)  # also applies to (forked or spawned) processes
+
+    if nWorkers == 1:
+        # Use this for debugging
+        jobs = enumerate(map(f, lst))
+    elif cost is None and not (mem or maxtasks):
+        import pathos.multiprocessing as MP
+        from pathos.threading import ThreadPool
+
         # Chunking is important for speed, but not done automatically by imap.
-        D = 1 + len(lst) // nCPU // 10  # heuristic chunksize
-        with MP.ProcessPool(nCPU) as pool:
-            jobs = pool.imap(f, lst, chunksize=D)
-    return list(progbar(jobs, total=len(lst)))
+        D = chunksize or 1 + len(lst) // nWorkers // 10  # heuristic chunksize
+        Pool = MP.ProcessPool if backend == "process" else ThreadPool
+        with Pool(nWorkers) as pool:
+            jobs = enumerate(pool.imap(f, lst, chunksize=D))
+    else:
+        chunks = chunked(lst, nWorkers, cost, chunksize)
+        jobs = imap_chunks(f, chunks, nWorkers, backend, mem, maxtasks)
+
+    jobs = progbar(jobs, total=len(lst), disable=quiet)
+    if not ordered:
+        yield from jobs
+        return
+
+    # Re-order
+    pending = {}
+    n = 0
+    for i, result in jobs:
+        pending[i] = result
+        while n in pending:
+            yield pending.pop(n)
+            n += 1
@@ -0,0 +1,142 @@
+"""Compact (array-backed) specification of a set of xps (kwargs dicts).
+
+Rather than a list of dicts (as made by `tools.dict_prod`), which takes gigabytes
+for millions of xps, a `ParamSpace` stores the distinct values of each parameter (key),
+and an integer array of `codes` (indices into these values), with one row per xp.
+Code `-1` means that the parameter is absent from that xp.
+Still, it behaves like a list of dicts (`len`, iteration, `O(1)` indexing),
+and slicing it (e.g. into batches for `save`) is cheap, as is shipping the slices.
+
+NB: parameter values must be hashable.
+"""
+
+import numpy as np
+
+
+class ParamSpace:
+    """Set of xps, i.e. (ordered) list of kwargs dicts.
+
+    Examples:
+    >>> methods = ParamSpace.from_dicts([dict(method="stochastic"), dict(method="det", seed=None)])
+    >>> common = ParamSpace.product(seed=3000 + np.arange(5), N=[10, 100, 1000])
+    >>> xps = (common * methods).dedupe()  # `methods` override `common`
+    >>> xps = xps.filter(lambda kw: kw["N"] > 10)
+    >>> xps = xps.override(xps.column("method") == "det", N=10_000)
+    >>> xps[3]
+    {'seed': None, 'N': 10000, 'method': 'det'}
+    """
+
+    def __init__(self, values: dict, codes):
+        self.values = values  # {key: [distinct values]}
+        self.codes = np.asarray(codes, dtype=np.int32).reshape(-1, len(values))
+
+    # ╔══════════════╗
+    # ║ Construction ║
+    # ╚══════════════╝
+    @classmethod
+    def product(cls, **kwargs):
+        """Product of `kwargs` values, like `tools.dict_prod` (first keys increment slowest)."""
+        values = {k: list(dict.fromkeys(vs)) for k, vs in kwargs.items()}
+        lookup = {k: {v: i for i, v in enumerate(vs)} for k, vs in values.items()}
+        axes = [[lookup[k][v] for v in vs] for k, vs in kwargs.items()]
+        grid = np.meshgrid(*axes, indexing="ij") if axes else []
+        codes = np.stack([g.ravel() for g in grid], axis=-1) if axes else np.zeros((1, 0))
+        return cls(values, codes)
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        values = {}
+        lookup = {}
+        rows = []
+        for d in dicts:
+            row = {}
+            for k, v in d.items():
+                table = lookup.setdefault(k, {})
+                if v not in table:
+                    table[v] = len(table)
+                    values.setdefault(k, []).append(v)
+                row[k] = table[v]
+            rows.append(row)
+        codes = [[row.get(k, -1) for k in values] for row in rows]
+        return cls(values, codes)
+
+    def to_dicts(self):
+        return list(self)
+
+    # ╔═══════════╗
+    # ║ Combining ║
+    # ╚═══════════╝
+    def _recode(self, values):
+        """Express codes in terms of (superset) `values` tables."""
+        codes = np.full((len(self), len(values)), -1, dtype=np.int32)
+        for j, (k, vs) in enumerate(values.items()):
+            if k in self.values:
+                lookup = {v: i for i, v in enumerate(vs)}
+                remap = np.array([lookup[v] for v in self.values[k]] + [-1], dtype=np.int32)
+                codes[:, j] = remap[self.codes[:, list(self.values).index(k)]]
+        return codes
+
+    def _merge(self, other):
+        values = {k: list(vs) for k, vs in self.values.items()}
+        for k, vs in other.values.items():
+            values[k] = list(dict.fromkeys([*values.get(k, []), *vs]))
+        return values, self._recode(values), other._recode(values)
+
+    def __add__(self, other):
+        """Union (concatenation) of xps."""
+        values, A, B = self._merge(other)
+        return ParamSpace(values, np.concatenate([A, B]))
+
+    def __mul__(self, other):
+        """Product: each xp of `self` gets combined with each of `other` (which overrides)."""
+        values, A, B = self._merge(other)
+        A = np.repeat(A, len(other), axis=0)
+        B = np.tile(B, (len(self), 1))
+        return ParamSpace(values, np.where(B >= 0, B, A))
+
+    def override(self, where=None, **kwargs):
+        """Set `kwargs` for xps (rows) selected by mask/indices `where` (default: all)."""
+        values, codes, _ = self._merge(ParamSpace.from_dicts([kwargs]))
+        for k, v in kwargs.items():
+            j = list(values).index(k)
+            codes[slice(None) if where is None else where, j] = values[k].index(v)
+        return ParamSpace(values, codes)
+
+    def filter(self, keep):
+        """Select xps by boolean mask, or predicate (callable on kwargs dict)."""
+        if callable(keep):
+            keep = np.fromiter(map(keep, self), dtype=bool, count=len(self))
+        return self[np.asarray(keep, dtype=bool)]
+
+    def dedupe(self):
+        """Remove duplicate xps (keeping order of first occurrences)."""
+        _, first = np.unique(self.codes, axis=0, return_index=True)
+        return self[np.sort(first)]
+
+    def column(self, key):
+        """Values of `key` (`None` if absent) for all xps, as (object) array."""
+        table = np.empty(len(self.values[key]) + 1, dtype=object)
+        table[:-1] = self.values[key]  # NB: table[-1] is None
+        return table[self.codes[:, list(self.values).index(key)]]
+
+    # ╔═══════════╗
+    # ║ List-like ║
+    # ╚═══════════╝
+    def __len__(self):
+        return len(self.codes)
+
+    def _row(self, row):
+        return {k: vs[c] for (k, vs), c in zip(self.values.items(), row) if c >= 0}
+
+    def __getitem__(self, index):
+        """Single xp (dict) if `index` is int, else (sub) `ParamSpace`."""
+        if isinstance(index, (int, np.integer)):
+            return self._row(self.codes[index])
+        return ParamSpace(self.values, self.codes[index])
+
+    def __iter__(self):
+        for row in self.codes:
+            yield self._row(row)
+
+    def __repr__(self):
+        return f"ParamSpace({len(self)} xps, keys={list(self.values)})"
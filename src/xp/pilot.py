@@ -0,0 +1,127 @@
+"""Pilot runs: estimate the cost of a sweep from a sample of its xps, and size the sweep by it.
+
+The sample (see `sample`) is dispatched (to the target host) with `instrument`,
+and its wall times and peak RSS are fitted by `CostModel`s (over the parameters),
+from which `plan` projects the total cost of the sweep, and picks `nCPU` (i.e. memory permitting),
+`nBatch`, the (longest-first) scheduling `cost`, and, for SLURM, the walltime and memory.
+"""
+
+import math
+import random
+from pathlib import Path
+
+BATCH_SECONDS = 10 * 60  # target duration of a batch (granularity of downloads and `resume`)
+TASK_SECONDS = 30 * 60  # target duration of a SLURM array task (amortizes queueing)
+MARGIN = 2  # safety factor, for walltime and memory
+
+
+def sample(xps, n, seed=0):
+    """Indices of a (stratified) random sample of `n` of the `xps`.
+
+    First, xps are picked to cover every value of each parameter with few (`<= n/2`) values,
+    as well as the extremes of the numeric ones (for which costs get interpolated).
+    The remainder of the sample is random.
+    """
+    from .catalog import summary
+
+    rng = random.Random(seed)
+    order = list(range(len(xps)))
+    rng.shuffle(order)
+    cover = set()
+    for key, values in summary(xps).items():
+        if len(values) <= n // 2:
+            cover |= {(key, v) for v in values}
+        elif numeric := [v for v in values if isinstance(v, (int, float))]:
+            cover |= {(key, min(numeric)), (key, max(numeric))}
+
+    chosen = []
+    for i in order:
+        if not cover or len(chosen) >= n:
+            break
+        if new := {(k, v) for k, v in xps[i].items() if (k, v) in cover}:
+            chosen.append(i)
+            cover -= new
+    rest = set(chosen)
+    chosen += [i for i in order if i not in rest][: n - len(chosen)]
+    return sorted(chosen)
+
+
+def walltime(seconds):
+    """Format for `sbatch --time`, e.g. `"1-02:03:04"`."""
+    d, s = divmod(math.ceil(seconds), 86400)
+    hms = f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}"
+    return f"{d}-{hms}" if d else hms
+
+
+def plan(xps, wall, rss=None, nCPU=None, mem=None, nHosts=1, sbatch=False):
+    """Pick `nCPU`, `nBatch`, `cost` (and `sbatch` options) for running `xps` (see `run`).
+
+    The `CostModel`s `wall` and `rss` (e.g. fitted by `run`) predict the xps' wall time and RSS
+(each evaluated once per xp, see `CostModel.predict`, and the walls returned as `costs`).
+    `nCPU` is that of (each) host, whose memory is `mem`. The returned `nCPU` is `None`
+    (i.e. use all of them) unless they cannot all be used (memory, too few xps).
+    """
+    from . import shards, slurm
+    from .local_mp import cpu_count
+
+    walls = wall.predict(xps)
+    total = walls.sum()
+    cores = nCPU or (slurm.CPUS_PER_NODE if sbatch else cpu_count())
+    nCPU = min(cores, len(xps))
+    peak = MARGIN * rss.predict(xps).max() if rss else None
+    if peak and mem and not sbatch:
+        nCPU = max(1, min(nCPU, int(mem // peak)))
+
+    target = TASK_SECONDS if sbatch else BATCH_SECONDS
+    nBatch = round(total / nCPU / target)
+    nBatch = max(4 * nHosts if nHosts > 1 else 1, min(nBatch, len(xps) // nCPU))
+
+    # Duration of the batches: sum (spread over nCPU), but at least its longest xp
+    batch_walls = [walls[a:b] for a, b in shards(len(xps), nBatch)]
+    longest = max(max(ws.sum() / nCPU, ws.max()) for ws in batch_walls)
+    span = longest * -(-nBatch // nHosts) if not sbatch else longest
+
+    out = dict(nCPU=nCPU if nCPU < cores else None, nBatch=nBatch, cost=wall, costs=walls)
+    info = [f"{len(xps)} xps, {total / 3600:.3g} CPU-hours"]
+    info += [f"⇒ {walltime(span)} on {nHosts} × {nCPU} CPUs, in {nBatch} batches"]
+    if sbatch:
+        out["sbatch"] = {"time": walltime(MARGIN * longest + 300)}
+        if peak:
+            out["sbatch"]["mem-per-cpu"] = f"{math.ceil(peak / 2**20)}M"
+        info += [f"(excl. queueing), with walltime {out['sbatch']['time']}"]
+    if peak:
+        info += [f"⇒ peak RSS per xp ≈ {peak / MARGIN / 2**20:.0f} MB"]
+    print("Projected:", *info)
+    return out
+
+
+def run(fun, xps, host=None, n=None, nHosts=1, sbatch=False, **kwargs):
+    """Dispatch a `sample` (of size `n`) of `xps` to `host`, and return the `plan` for all of them.
+
+    Example: `dispatch(fun, xps, host, **run(fun, xps, host))`. See also `dispatch(pilot=...)`.
+    The `kwargs` are passed on to `dispatch`, except `data_root` (and `data_root_on_remote`),
+    under which the pilot run goes in `pilots/`.
+    """
+    from . import dispatch, uplink
+    from .costs import CostModel, timings
+    from .instrument import mem_available
+
+    n = min(len(xps), n or max(20, min(200, len(xps) // 100)))
+    idx = sample(xps, n)
+    for key in ["data_root", "data_root_on_remote"]:
+        if kwargs.get(key) is not None:
+            kwargs[key] = Path(kwargs[key]) / "pilots"
+    print(f"Pilot: running {n} of the {len(xps)} xps.")
+    kws = dict(kwargs, nBatch=1, sbatch=sbatch, instrument=True)
+    data_dir = dispatch(fun, [xps[i] for i in idx], host, **kws)
+
+    wall = CostModel(timings(data_dir))
+    rss = list(timings(data_dir, "rss"))
+    rss = CostModel(rss) if rss and all(r for _, r in rss) else None
+    if host and not sbatch:
+        caps = uplink.Uplink(host).capabilities()
+        nCPU, mem = caps["nCPU"], caps["mem"]
+    else:
+        nCPU, mem = None, mem_available()
+    nCPU = kwargs.get("nCPU") or nCPU
+    return plan(xps, wall, rss, nCPU, mem, nHosts, sbatch)
@@ -0,0 +1,158 @@
+"""Progress events, emitted by the workers (`launch_xps.py`) and aggregated by `dispatch`.
+
+Events are printed (to stdout) as lines of JSON prefixed by `PREFIX`,
+and so get consumed the same way from a local subprocess as over the ssh channel.
+Example: `@xp {"batch": "3", "n": 17, "nFail": 0, "wall": 8.4}`
+"""
+
+import json
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+PREFIX = "@xp "
+DEPTH = 2  # batches in flight, per `Worker`
+_lock = threading.Lock()  # ⇒ lines don't get mixed up (e.g. by `launch_xps.serve`)
+
+
+def emit(**event):
+    with _lock:
+        print(PREFIX + json.dumps(event), flush=True)
+
+
+class Emitter:
+    """Emit progress of a batch, throttled to once per `interval` (seconds)."""
+
+    def __init__(self, batch, total, done=0, interval=0.5):
+        self.batch = str(batch)
+        self.interval = interval
+        self.reset()
+        emit(batch=self.batch, total=total, done=done)
+
+    def reset(self):
+        self.n = 0
+        self.nFail = 0
+        self.wall = 0.0
+        self.last = time.monotonic()
+
+    def update(self, wall, failed=False):
+        """Register an xp that took `wall` seconds."""
+        self.n += 1
+        self.nFail += failed
+        self.wall += wall
+        if time.monotonic() - self.last > self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.n:
+            emit(batch=self.batch, n=self.n, nFail=self.nFail, wall=round(self.wall, 6))
+        self.reset()
+
+    def close(self, error=None):
+        self.flush()
+        emit(batch=self.batch, end=True, error=error and repr(error))
+
+
+class Tracker:
+    """Aggregate the progress events of all batches (and hosts) into a single progress bar.
+
+    The postfix shows the throughput (xps/s) of each host, to help spot stragglers.
+    """
+
+    def __init__(self, total):
+        from .local_mp import progbar
+
+        self.bar = progbar(total=total, desc="xps", file=sys.stdout)
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.bar.close()
+
+    def update(self, host, event):
+        with self.lock:
+            stats = self.hosts.setdefault(host, dict(t0=time.monotonic(), n=0, nFail=0, wall=0))
+            if "total" in event:
+                self.bar.update(event["done"])  # e.g. from previous (resumed) run
+            elif "n" in event:
+                for key in ["n", "nFail", "wall"]:
+                    stats[key] += event[key]
+                self.bar.update(event["n"])
+                self.bar.set_postfix_str(self.postfix(), refresh=False)
+
+    def postfix(self):
+        rates = []
+        for host, stats in self.hosts.items():
+            rate = stats["n"] / max(time.monotonic() - stats["t0"], 1e-9)
+            fails = f" ✗{stats['nFail']}" if stats["nFail"] else ""
+            rates.append(f"{host}: {rate:.3g}/s{fails}")
+        return ", ".join(rates)
+
+
+class Worker:
+    """Long-lived worker (`launch_xps.py` with `dir_xps="-"`), fed batches via stdin.
+
+    Its (warm) process pool thus gets reused for all of the batches.
+    With `depth` batches in flight, the next batch is already queued when one finishes
+    ⇒ its stragglers don't leave CPUs idle (see `launch_xps.serve`).
+    """
+
+    def __init__(self, tracker, host, args, depth=DEPTH, **kwargs):
+        self.tracker = tracker
+        self.host = host
+        self.args = args
+        self.depth = depth
+        self.pending = []  # batches submitted, but not done
+        kwargs = dict(stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1, **kwargs)
+        self.proc = subprocess.Popen(args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.proc.stdin.close()
+        if exc[0] is not None:
+            self.proc.terminate()  # rather than finish the pending batches
+        self.proc.wait()
+
+    def submit(self, dir_xps):
+        """Queue the batch at (path) `dir_xps`."""
+        self.proc.stdin.write(f"{dir_xps}\n")
+        self.proc.stdin.flush()
+        self.pending.append(dir_xps)
+
+    def wait(self):
+        """Return (the path of) the next batch (of the `pending`) to finish, or raise if failed."""
+        for line in self.proc.stdout:
+            if not line.startswith(PREFIX):
+                self.tracker.bar.write(line, end="")
+                continue
+            event = json.loads(line[len(PREFIX) :])
+            self.tracker.update(self.host, event)
+            if event.get("end"):
+                if event["error"]:
+                    raise RuntimeError(f"Batch {event['batch']} failed: {event['error']}")
+                i = [Path(p).name for p in self.pending].index(event["batch"])
+                return self.pending.pop(i)
+        # EOF ⇒ worker died (e.g. segfault, or OOM-killed)
+        raise subprocess.CalledProcessError(self.proc.wait(), self.args)
+
+    def serve(self, batches, on_done=None):
+        """Run the `batches` (paths), keeping (up to) `depth` of them in flight.
+
+        `on_done(dir_xps)` gets called as each of them finishes.
+        """
+        batches = iter(batches)
+        while True:
+            while len(self.pending) < self.depth and (dir_xps := next(batches, None)):
+                self.submit(dir_xps)
+            if not self.pending:
+                return
+            dir_xps = self.wait()
+            if on_done:
+                on_done(dir_xps)
@@ -0,0 +1,28 @@
+"""Reduce the results of a dispatch where they are (i.e. on the remote), before transferring them.
+
+`run(data_dir)` applies the (pickled) `data_dir/reducer` to the xps and results,
+saving the output in `data_dir/reduced`. See `dispatch(reduce=...)`.
+"""
+
+from pathlib import Path
+
+import dill
+
+
+def run(data_dir: Path):
+    """Return `True` if reduced, i.e. unless some results are missing."""
+    from . import incomplete, load_batches  # avoid circular import
+
+    data_dir = Path(data_dir).expanduser()
+    if missing := incomplete(data_dir):
+        print(f"Not reducing, since batch(es) {missing} are missing results.")
+        return False
+    reducer = dill.loads((data_dir / "reducer").read_bytes())
+    reduced = reducer(load_batches(data_dir, "xps"), load_batches(data_dir))
+    (data_dir / "reduced").write_bytes(dill.dumps(reduced))
+    return True
+
+
+def load_reduced(data_dir: Path):
+    """Load the output of the reducer of `dispatch(reduce=...)`."""
+    return dill.loads((Path(data_dir) / "reduced").read_bytes())
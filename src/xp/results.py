@@ -0,0 +1,174 @@
+"""Load the parameters and results of a dispatch as a table (`pandas`) or array (sparse `xarray`).
+
+The first `load` converts the (pickled) batches of `data_dir` into `data_dir/columns/`,
+with one file per column: numeric ones as `.npy` (⇒ memory-mapped when loaded),
+and others (e.g. `method`) as categorical codes (`.npy`) and their categories (pickled).
+Re-loading (and slicing) is then fast, even for millions of xps.
+"""
+
+import json
+import shutil
+from pathlib import Path
+
+import dill
+import numpy as np
+
+COLUMNS = "columns"
+
+
+def transpose(records):
+    """Convert list of dicts into dict of lists (with `None` for missing entries)."""
+    cols = {}
+    for n, rec in enumerate(records):
+        for key, val in rec.items():
+            cols.setdefault(key, [None] * n).append(val)
+        for key, col in cols.items():
+            if len(col) == n:
+                col.append(None)
+    return cols
+
+
+def save_column(cdir: Path, name: str, values: list):
+    """Save as numeric `.npy` if possible, else as categorical codes, else as pickle."""
+
+    def path(ext):
+        return cdir / (name + ext)
+
+    if all(np.ndim(v) == 0 for v in values):
+        present = [v for v in values if v is not None]
+        arr = np.asarray(present)
+        if len(present) < len(values) and arr.dtype.kind in "biuf":
+            arr = np.asarray([np.nan if v is None else v for v in values], dtype=float)
+        if len(arr) == len(values) and arr.dtype.kind in "biufcmM":
+            np.save(path(".npy"), arr)
+            return "numeric"
+        try:
+            cats = list(dict.fromkeys(present))
+        except TypeError:  # unhashable
+            pass
+        else:
+            index = {c: i for i, c in enumerate(cats)}
+            codes = np.asarray([-1 if v is None else index[v] for v in values], dtype=np.int32)
+            np.save(path(".npy"), codes)
+            path(".cats").write_bytes(dill.dumps(cats))
+            return "categorical"
+    path(".pkl").write_bytes(dill.dumps(values))
+    return "object"
+
+
+def convert(data_dir: Path):
+    """Convert `data_dir/xps` and `data_dir/res` into `data_dir/columns`."""
+    from . import load_batches  # avoid circular import
+
+    xps = load_batches(data_dir, "xps")
+    results = load_batches(data_dir)
+    if len(results) != len(xps):
+        msg = f"Only {len(results)} of {len(xps)} results found. Use `dispatch(resume=...)`."
+        raise RuntimeError(msg)
+
+    # Non-dict results go in column "result"
+    results = [r if isinstance(r, dict) else {"result": r} for r in results]
+    params = transpose(xps)
+    fields = transpose(results)
+    fields = {(f"result.{k}" if k in params else k): v for k, v in fields.items()}
+
+    # Write to tmp, then rename ⇒ never partially converted
+    tmp = data_dir / (COLUMNS + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+    kinds = {name: save_column(tmp, name, col) for name, col in {**params, **fields}.items()}
+    meta = dict(params=list(params), results=list(fields), kinds=kinds, length=len(xps))
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+    tmp.rename(data_dir / COLUMNS)
+
+
+def load_columns(data_dir: Path):
+    """Load `data_dir/columns` (converting first, if need be). Returns `meta, columns`."""
+    import pandas as pd
+
+    data_dir = Path(data_dir)
+    cdir = data_dir / COLUMNS
+    if not cdir.exists():
+        convert(data_dir)
+    meta = json.loads((cdir / "meta.json").read_text())
+
+    columns = {}
+    for name, kind in meta["kinds"].items():
+
+        def path(ext):
+            return cdir / (name + ext)
+
+        if kind == "numeric":
+            columns[name] = np.load(path(".npy"), mmap_mode="r")
+        elif kind == "categorical":
+            codes = np.load(path(".npy"), mmap_mode="r")
+            cats = dill.loads(path(".cats").read_bytes())
+            columns[name] = pd.Categorical.from_codes(codes, pd.Index(cats, dtype=object))
+        else:
+            columns[name] = dill.loads(path(".pkl").read_bytes())
+    return meta, columns
+
+
+def load(data_dir: Path, kind="frame"):
+    """Load parameters and results of `data_dir` as a `pandas.DataFrame`.
+
+    With `kind="xarray"`, returns (sparse) `xarray.Dataset` of the numeric result fields,
+    indexed by the parameters, or a `DataArray` if there is only a single such field.
+    """
+    import pandas as pd
+
+    meta, columns = load_columns(data_dir)
+    df = pd.DataFrame(columns, copy=False)
+    if kind == "frame":
+        return df
+
+    elif kind == "xarray":
+        import sparse
+        import xarray as xr
+
+        # NB: Don't use `xr.Dataset.from_dataframe(sparse=True)`, which mishandles NaN indices.
+        codes, coords = [], {}
+        for param in meta["params"]:
+            c, uniques = pd.factorize(df[param], sort=True, use_na_sentinel=False)
+            codes.append(c)
+            coords[param] = np.asarray(uniques)
+        codes = np.array(codes)
+        if len(np.unique(codes, axis=1).T) < len(df):
+            raise ValueError("The parameters of some xps are duplicates.")
+
+        shape = [len(c) for c in coords.values()]
+        fields = [f for f in meta["results"] if df[f].dtype.kind in "biuf"]
+        ds = xr.Dataset(
+            {
+                f: (list(coords), sparse.COO(codes, df[f].astype(float), shape, fill_value=np.nan))
+                for f in fields
+            },
+            coords,
+        )
+        if len(fields) == 1:
+            return ds[fields[0]]
+        return ds
+
+    raise ValueError(f"Unknown kind: {kind!r}")
+
+
+def load_stats(data_dir: Path):
+    """Load parameters and `stats` (see `xp.instrument`) of the xps of `data_dir` as a `DataFrame`.
+
+    Also works for incomplete (e.g. running) dispatches: xps without stats get NaN.
+    """
+    import pandas as pd
+
+    from . import serial, store
+
+    data_dir = Path(data_dir)
+    paths = sorted((data_dir / "xps").iterdir(), key=lambda p: int(p.name))
+    params, stats = [], []
+    for path in paths:
+        xps = list(serial.load(path))
+        recs = [{}] * len(xps)
+        for i, rec in store.read(data_dir / "stats" / path.name):
+            recs[i] = rec
+        params += xps
+        stats += recs
+    return pd.concat([pd.DataFrame(params), pd.DataFrame(stats, index=range(len(stats)))], axis=1)
@@ -0,0 +1,119 @@
+"""Serialization of xps and results: `dill` (pickle protocol 5) with out-of-band buffers.
+
+Format: `MAGIC`, codec, and sizes, followed by the pickle stream (optionally compressed),
+followed by the raw buffers (i.e. data of numpy arrays), each aligned to `ALIGN` bytes.
+Hence arrays are written without being copied into the pickle stream,
+and `load` memory-maps the file, so that the arrays are (copy-on-write) views into it.
+Data not starting with `MAGIC` is loaded as plain `dill` (i.e. the previous format).
+"""
+
+import io
+import mmap
+import sys
+import zlib
+from importlib import import_module
+from pathlib import Path
+
+import dill
+
+MAGIC = b"XP\x05\x00"
+ALIGN = 64
+INT = 8
+
+# Compression of the pickle stream (not the buffers). Add your own: `name: (compress, decompress)`
+CODECS = {
+    "zlib": (lambda b: zlib.compress(b, 1), zlib.decompress),
+    "zstd": (
+        lambda b: import_module("zstandard").ZstdCompressor().compress(b),
+        lambda b: import_module("zstandard").ZstdDecompressor().decompress(b),
+    ),
+    "lz4": (
+        lambda b: import_module("lz4.frame").compress(b),
+        lambda b: import_module("lz4.frame").decompress(b),
+    ),
+}
+
+
+class Pickler(dill.Pickler):
+    def reducer_override(self, obj):
+        # Unlike `dill`, let (plain) numpy arrays provide `PickleBuffer`s ⇒ out-of-band
+        np = sys.modules.get("numpy")
+        if np and type(obj) is np.ndarray and not obj.dtype.hasobject:
+            if obj.flags.c_contiguous or obj.flags.f_contiguous:
+                return obj.__reduce_ex__(5)
+        return NotImplemented
+
+
+def dump_chunks(obj, codec=None, offset=0):
+    """Serialize `obj` into a list of chunks (incl. views of the arrays of `obj`).
+
+    The buffers get aligned for the data being written at (file position) `offset`.
+    """
+    buffers = []
+    f = io.BytesIO()
+    Pickler(f, protocol=5, buffer_callback=buffers.append).dump(obj)
+    stream = f.getvalue()
+    if codec:
+        stream = CODECS[codec][0](stream)
+    buffers = [b.raw() for b in buffers]
+
+    name = (codec or "").encode()
+    header = [MAGIC, len(name).to_bytes(1, "little"), name, len(stream).to_bytes(INT, "little")]
+    header += [len(buffers).to_bytes(INT, "little")]
+    header += [b.nbytes.to_bytes(INT, "little") for b in buffers]
+    chunks = [*header, stream]
+    pos = offset + sum(len(c) for c in chunks)
+    for b in buffers:
+        pad = -pos % ALIGN
+        chunks += [bytes(pad), b]
+        pos += pad + b.nbytes
+    return chunks
+
+
+def dumps(obj, codec=None):
+    return b"".join(dump_chunks(obj, codec))
+
+
+def dump(obj, path: Path, codec=None):
+    with open(path, "wb") as f:
+        f.writelines(dump_chunks(obj, codec))
+
+
+def loads(data, offset=0):
+    """Inverse of `dumps`. The arrays are views of `data` (starting at file position `offset`)."""
+    data = memoryview(data)
+    if data[: len(MAGIC)] != MAGIC:
+        return dill.loads(data)
+
+    def read(n):
+        nonlocal pos
+        pos += n
+        return data[pos - n : pos]
+
+    def read_int():
+        return int.from_bytes(read(INT), "little")
+
+    pos = len(MAGIC)
+    codec = bytes(read(read(1)[0])).decode()
+    size = read_int()
+    sizes = [read_int() for _ in range(read_int())]
+    stream = read(size)
+    if codec:
+        stream = CODECS[codec][1](stream)
+    buffers = []
+    for n in sizes:
+        pos += -(offset + pos) % ALIGN
+        buffers.append(read(n))
+    return dill.loads(stream, buffers=buffers)
+
+
+def map_file(path: Path):
+    """Memory-map file (copy-on-write ⇒ arrays are writable, but writes don't reach the file)."""
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+
+def load(path: Path):
+    return loads(map_file(path))
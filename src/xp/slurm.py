@@ -0,0 +1,143 @@
+"""Run batches of xps as a SLURM job array (one batch per array task).
+
+Each array task runs `launch_xps.py` on its batch (so the xps of a task get `mp`-ed),
+and should run long enough to amortize the queueing overhead (see `layout`).
+Monitoring uses a single `sacct` query (for the whole array), at an adaptive interval.
+Failed tasks can be re-submitted on their own with `dispatch(resume=...)`,
+which only submits the tasks whose batches are incomplete.
+"""
+
+import re
+import time
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from .local_mp import progbar
+
+# Default `sbatch` options. Override via `dispatch(sbatch=dict(...))`.
+SBATCH = {
+    "qos": "normal",  # Only one available I think
+    "account": "energytech",  # Unnecessary it seems
+    "job-name": "xps",
+    "partition": "comp",  # Type of nodes?
+    "time": "00:05:00",  # Maximum runtime (HH:MM:SS)
+    "ntasks": 1,  # Only useful with `srun` ?
+    "nodes": 1,  # Only useful with `srun` ?
+}
+CPUS_PER_NODE = 255  # default for `--cpus-per-task`
+MIN_XPS_PER_CPU = 100  # ⇒ batch_size >= nCPU * 100
+
+# Terminal states (as reported by `sacct`)
+DONE = "COMPLETED"
+FAILED = ["FAILED", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL", "PREEMPTED", "DEADLINE"]
+
+
+def layout(nXps, nCPU=None, nBatch=None):
+    """Pick the number of array tasks (`nBatch`) and `--cpus-per-task` (`nCPU`).
+
+    Unless specified, `nBatch` is as large as possible while still giving each task
+    `nCPU * MIN_XPS_PER_CPU` xps, and `nCPU` is reduced if a task has fewer xps than that.
+    """
+    nCPU = nCPU or CPUS_PER_NODE
+    if nBatch is None:
+        nBatch = max(1, nXps // (nCPU * MIN_XPS_PER_CPU))
+    batch_size = -(-nXps // nBatch)  # ceil
+    return nBatch, max(1, min(nCPU, batch_size))
+
+
+def array_spec(tasks):
+    """Compress task indices, e.g. `[0, 1, 2, 5, 7, 8]` ⇒ `"0-2,5,7-8"`."""
+    ranges = []
+    for t in sorted(tasks):
+        if ranges and t == ranges[-1][1] + 1:
+            ranges[-1][1] = t
+        else:
+            ranges.append([t, t])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def render(tasks, nCPU, options=None, **fields):
+    """Fill in `slurm_script.sbatch` (with `fields`)."""
+    options = {
+        **SBATCH,
+        **(options or {}),
+        "output": "output/%a",  # StdOut (separate files per array task)
+        "error": "error/%a",  # StdErr
+        "cpus-per-task": nCPU,
+        "array": array_spec(tasks),  # job/batch indices
+    }
+    directives = "\n".join(f"#SBATCH --{k}={v}" for k, v in options.items())
+    txt = (Path(__file__).parent / "slurm_script.sbatch").read_text()
+    return eval(f"f'''{txt}'''", {}, dict(directives=directives, **fields))
+
+
+def submit(remote, stage, txt):
+    """Upload job script (`txt`) to (remote dir) `stage` and submit it. Return job id."""
+    with NamedTemporaryFile(mode="w+t", delete_on_close=False) as sbatch:
+        sbatch.write(txt)
+        sbatch.close()
+        remote.rsync(sbatch.name, f"{stage}/job_script.sbatch")
+    remote.cmd(f"mkdir -p {stage}/output {stage}/error")
+    job_id = remote.cmd(f"cd {stage}; sbatch job_script.sbatch")
+    print(job_id.stdout, end="")
+    return int(re.search(r"job (\d*)", job_id.stdout).group(1))
+
+
+def states(remote, job_id):
+    """State of each array task, from a single `sacct` query."""
+    cmd = f"sacct -j {job_id} -X -n -P --format=JobID,State"
+    states = {}
+    for line in remote.cmd(cmd, check=False).stdout.splitlines():
+        task, state = line.split("|")[:2]
+        state = state.split()[0]  # e.g. "CANCELLED by 123"
+        # Pending tasks are listed as ranges, e.g. 123_[4-9%2]
+        if m := re.search(r"_\[(.*?)(%\d+)?\]$", task):
+            for part in m.group(1).split(","):
+                a, _, b = part.partition("-")
+                for t in range(int(a), int(b or a) + 1):
+                    states[t] = state
+        elif m := re.search(r"_(\d+)$", task):
+            states[int(m.group(1))] = state
+    return states
+
+
+def monitor(remote, job_id, tasks, interval=(2, 60), on_done=None):
+    """Wait for array tasks to finish. Poll every `interval[0]` seconds,
+    backing off (up to `interval[1]`) while nothing changes. Return states.
+
+    Calls `on_done(new)` with the tasks that completed since last poll, e.g. to download them.
+    """
+    dt, dt_max = interval
+    completed = set()
+    with progbar(total=len(tasks), desc="Tasks") as pbar:
+        while True:
+            time.sleep(dt)  # dont clog the ssh uplink
+            now = states(remote, job_id)
+            new = [t for t in tasks if now.get(t) == DONE and t not in completed]
+            if new and on_done:
+                on_done(new)
+            completed.update(new)
+            finished = sum(now.get(t) in [DONE, *FAILED] for t in tasks)
+            if finished > pbar.n:
+                pbar.update(finished - pbar.n)
+                dt = interval[0]
+            else:
+                dt = min(1.5 * dt, dt_max)
+            if finished == len(tasks):
+                return now
+
+
+def run(remote, stage, tasks, nCPU, options=None, on_done=None, **fields):
+    """Submit `tasks` (batch indices), monitor them, and report errors."""
+    txt = render(tasks, nCPU, options, stage=stage, **fields)
+    job_id = submit(remote, stage, txt)
+    final = monitor(remote, job_id, tasks, on_done=on_done)
+
+    # Provide error summary
+    failed = [t for t in tasks if final.get(t) != DONE]
+    for task in failed:
+        print(f" Error for job {job_id}_{task} ({final.get(task)}) ".center(70, "="))
+        print(remote.cmd(f"tail -n 30 {stage}/error/{task}", check=False).stdout)
+    if failed:
+        msg = f"Task(s) {array_spec(failed)} failed, see printout above."
+        raise RuntimeError(msg + " Re-submit (only) them with `dispatch(resume=...)`.")
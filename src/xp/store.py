@@ -0,0 +1,88 @@
+"""Append-only storage of results, written as they come (⇒ crash-resumable).
+
+A store (file) is a sequence of records, each of which is the pickled result,
+prefixed by its index (in the batch) and its length.
+A record cut short (by a crash) is thus detectable, and gets dropped.
+The results are serialized with `serial` (and so their arrays are memory-mapped when read).
+"""
+
+from pathlib import Path
+
+from . import serial
+
+INT = 8  # bytes per header field
+
+
+def _scan(f):
+    """Yield `(index, size)` for each complete record, leaving `f` positioned at its payload."""
+    while len(header := f.read(2 * INT)) == 2 * INT:
+        index = int.from_bytes(header[:INT], "little")
+        size = int.from_bytes(header[INT:], "little")
+        start = f.tell()
+        if f.seek(0, 2) - start < size:
+            break  # partial record
+        f.seek(start)
+        yield index, size
+        f.seek(start + size)
+
+
+def read(path: Path):
+    """Yield the `(index, result)` records of store at `path`."""
+    if not Path(path).exists():
+        return
+    data = serial.map_file(path)
+    with open(path, "rb") as f:
+        for index, size in _scan(f):
+            pos = f.tell()
+            if pos + size > len(data):
+                break  # appended after mapping
+            yield index, serial.loads(data[pos : pos + size], offset=pos)
+
+
+def done(path: Path):
+    """Indices in store. Read-only (i.e. safe while it's being written)."""
+    if not Path(path).exists():
+        return set()
+    with open(path, "rb") as f:
+        return {index for index, _ in _scan(f)}
+
+
+def truncate(path: Path):
+    """Drop any trailing partial record (from a crash), so that the store can be appended to."""
+    if not Path(path).exists():
+        return
+    with open(path, "r+b") as f:
+        end = 0
+        for _, size in _scan(f):
+            end = f.tell() + size
+        f.truncate(end)
+
+
+def load(path: Path):
+    """List of results in store, ordered by index."""
+    return [result for _, result in sorted(read(path), key=lambda rec: rec[0])]
+
+
+class Writer:
+    """Append `(index, result)` records to store at `path`, flushing each one to disk.
+
+    The `codec` (see `serial.CODECS`) compresses the non-array parts of results.
+    """
+
+    def __init__(self, path: Path, codec=None):
+        truncate(path)
+        self.file = open(path, "ab")
+        self.codec = codec
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    def append(self, index, result):
+        chunks = serial.dump_chunks(result, self.codec, offset=self.file.tell() + 2 * INT)
+        size = sum(memoryview(c).nbytes for c in chunks)
+        self.file.write(index.to_bytes(INT, "little") + size.to_bytes(INT, "little"))
+        self.file.writelines(chunks)
+        self.file.flush()
@@ -4,16 +4,69 @@ Requires rsync and ssh access to the server.
 """
 
 from contextlib import contextmanager
+from functools import cache
 from pathlib import Path
+import hashlib
 import os
 import subprocess
+import threading
+import uuid
+
+SNAPSHOTS = "~/.cache/xp/snapshots"  # on remote
+KEEP_SNAPSHOTS = 10  # per dir name. Older ones are deleted (hardlinked copies are unaffected).
+MAX_TRANSFERS = 8  # rsync's at once (over all hosts) ⇒ many hosts don't saturate the uplink
+MAX_SESSIONS = 8  # ssh commands/transfers at once per host (cf. `MaxSessions 10` of sshd)
+
+
+@cache
+def rsync_version():
+    """Version of (local) rsync, e.g. `(3, 2, 3)`. Cached, since it's called for every rsync."""
+    v = (
+        subprocess.run(["rsync", "--version"], check=True, text=True, capture_output=True)
+        .stdout.splitlines()[0]
+        .split()
+    )
+    i = v.index("version")
+    v = v[i + 1]  # => '3.2.3'
+    return tuple(int(w) for w in v.split("."))
+
+
+def fingerprint(path: Path):
+    """Hash of the paths, sizes and mtimes of all files in `path` (cf. the "quick check" of rsync).
+
+    Symlinks are followed (like `rsync -L`).
+    """
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(path, followlinks=True):
+        dirs.sort()
+        for name in sorted(files):
+            f = Path(root) / name
+            try:
+                st = f.stat()
+            except FileNotFoundError:  # e.g. broken symlink
+                continue
+            h.update(f"{f.relative_to(path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:16]
 
 
 class Uplink:
-    """Multiplexed connection to `host` via ssh."""
+    """Multiplexed connection to `host` via ssh.
+
+    All commands and transfers (e.g. from several threads) share the single (master) connection.
+    Their concurrency (e.g. of many hosts) is bounded by `MAX_TRANSFERS` and `MAX_SESSIONS`.
+    With `snapshots`, the `other` dirs of `sym_sync` are uploaded via `snapshot`.
+    """
+
+    # Capabilities of remotes, probed once per host
+    _probed = {}
+    # Bounds on concurrency (shared by all instances, i.e. threads)
+    _transfers = threading.BoundedSemaphore(MAX_TRANSFERS)
+    _sessions = {}  # per host
 
-    def __init__(self, host, progbar=False, dry=False, use_M=True):
+    def __init__(self, host, progbar=False, dry=False, use_M=True, snapshots=True):
         self.host = host
+        self.session = Uplink._sessions.setdefault(host, threading.BoundedSemaphore(MAX_SESSIONS))
+        self.snapshots = snapshots
         self.progbar = progbar
         self.dry = dry
         self.use_M = use_M
@@ -32,22 +85,42 @@ class Uplink:
             ]
         )
 
-    def cmd(self, cmd: str, login_shell=True, **kwargs):
+    def ssh_args(self, cmd, login_shell=True):
         if isinstance(cmd, list):
             cmd = " ".join([str(x) for x in cmd])
         if login_shell:
             # sources ~/.bash_profile or ~/.profile, which may or not include ~/.bashrc
             cmd = f"bash -l -c '{cmd}'"
+        return [*self.ssh_M.split(), self.host, cmd]
 
+    def cmd(self, cmd: str, login_shell=True, **kwargs):
         kwargs = {**dict(check=True, text=True, capture_output=True), **kwargs}
         try:
-            return subprocess.run([*self.ssh_M.split(), self.host, cmd], **kwargs)
+            with self.session:
+                return subprocess.run(self.ssh_args(cmd, login_shell), **kwargs)
         except subprocess.CalledProcessError as error:
             if kwargs.get("capture_output"):
                 print(error.stderr)
             raise
 
-    def rsync(self, src, dst, opts=(), reverse=False):
+    def capabilities(self):
+        """Probe (once per host) the remote for its nCPU and (available) memory."""
+        if self.host not in Uplink._probed:
+            # Labelled ⇒ robust to missing programs, and to noise (e.g. motd of login shell)
+            probe = "echo nCPU=$(nproc); echo mem=$(grep MemAvailable /proc/meminfo)"
+            fields = dict.fromkeys(["nCPU", "mem"], [])
+            for line in self.cmd(probe, check=False).stdout.splitlines():
+                key, _, value = line.partition("=")
+                if key in fields:
+                    fields[key] = value.split()
+            nCPU, mem = fields.values()
+            Uplink._probed[self.host] = dict(
+                nCPU=int(nCPU[0]) if nCPU[:1] and nCPU[0].isdigit() else None,
+                mem=int(mem[1]) * 1024 if mem[1:2] and mem[1].isdigit() else None,  # bytes
+            )
+        return Uplink._probed[self.host]
+
+    def rsync_args(self, src, dst, opts=(), reverse=False):
         # Prepare: opts
         if isinstance(opts, str):
             opts = opts.split()
@@ -59,18 +132,8 @@ class Uplink:
         if reverse:
             src, dst = dst, src
 
-        # Get rsync version
-        v = (
-            subprocess.run(["rsync", "--version"], check=True, text=True, capture_output=True)
-            .stdout.splitlines()[0]
-            .split()
-        )
-        i = v.index("version")
-        v = v[i + 1]  # => '3.2.3'
-        v = [int(w) for w in v.split(".")]
-        has_prog2 = (v[0] >= 3) and (v[1] >= 1)
-
         # Show progress
+        has_prog2 = rsync_version() >= (3, 1)
         if self.progbar and has_prog2:
             progbar = ("--info=progress2", "--no-inc-recursive")
         else:
@@ -83,30 +146,112 @@ class Uplink:
             multiplex = []
 
         # Assemble command
-        cmd = ["rsync", "-azhL", *progbar, *multiplex, *opts, src, dst]
+        return ["rsync", "-azhL", *progbar, *multiplex, *opts, src, dst]
 
+    def rsync(self, src, dst, opts=(), reverse=False):
+        cmd = self.rsync_args(src, dst, opts, reverse)
         if self.dry:
             # Dry run
             return " ".join(cmd)
         else:
             # Sync
-            subprocess.run(cmd, check=True)
+            with Uplink._transfers, self.session:
+                subprocess.run(cmd, check=True)
             return None
 
+    def _snapshot_cmds(self, src: Path, dst: Path):
+        """Commands for `snapshot`: `lookup, upload, finalize, link`."""
+        snaps = f"{SNAPSHOTS}/{src.name}"
+        key = fingerprint(src)
+        snap = f"{snaps}/{key}"
+        tmp = f"{snap}.tmp-{uuid.uuid4().hex[:8]}"  # unique, in case of concurrent uploads
+        lookup = f"mkdir -p {snaps}; test -d {snap} && echo found"
+        # NB: relative `--link-dest` is relative to (upload) destination dir
+        upload = self.rsync_args(f"{src}/", tmp, "--link-dest=../latest")
+        finalize = "; ".join(
+            [
+                f"mv -T {tmp} {snap} || rm -rf {tmp}",  # lost race ⇒ use the other
+                f"ln -sfn {key} {snaps}/latest",
+            ]
+        )
+        link = "; ".join(
+            [
+                f"touch {snap}",  # mark as used, for pruning
+                f"mkdir -p {dst.parent}",
+                f"rm -rf {dst}",
+                f"cp -al {snap} {dst} || cp -a {snap} {dst}",
+                # Prune least recently used
+                f"cd {snaps}",
+                f"ls -1t | grep -v -e ^latest$ -e .tmp- | tail -n +{KEEP_SNAPSHOTS + 1}"
+                " | xargs -r rm -rf",
+            ]
+        )
+        return lookup, upload, finalize, link
+
+    def snapshot(self, src: Path, dst):
+        """Upload dir `src` to `dst` (on host) via a snapshot (in `SNAPSHOTS`).
+
+        Snapshots are identified by the `fingerprint` of `src`, and so are only uploaded
+        if (something in) `src` changed, in which case only the changed files are transferred,
+        the others being hardlinked (`--link-dest`) to the previous snapshot.
+        Then `dst` is populated with hardlinks (`cp -al`) ⇒ costs (next to) no disk space.
+        NB: Hence, files in `dst` should not be modified in-place (replacing them is fine).
+        """
+        lookup, upload, finalize, link = self._snapshot_cmds(src, Path(dst))
+        if "found" not in self.cmd(lookup, check=False).stdout:
+            with Uplink._transfers, self.session:
+                subprocess.run(upload, check=True)
+            self.cmd(finalize)
+        self.cmd(link)
+
+    @staticmethod
+    def _only(paths):
+        """Filter rules for rsync to only transfer `paths` (files or dirs, with their contents)."""
+        rules = []
+        for path in paths:
+            parts = Path(path).parts
+            rules += [f"--include=/{'/'.join(parts[:i])}/" for i in range(1, len(parts))]
+            # NB: `--exclude=*` also applies within dirs ⇒ include their contents (`***`)
+            rules += [f"--include=/{path}", f"--include=/{path}/***"]
+        return [*rules, "--exclude=*"]
+
+    def pull(self, target_dir: Path | str, source_dir: Path, paths):
+        """Download (only) `paths` (relative) of `target_dir` on host into `source_dir`."""
+        return self.rsync(f"{source_dir}", f"{target_dir}/", self._only(paths), reverse=True)
+
+    def push(self, target_dir: Path | str, source_dir: Path, paths):
+        """Upload (only) `paths` (relative) of `source_dir` into `target_dir` on host."""
+        return self.rsync(f"{source_dir}/", target_dir, self._only(paths))
+
+    @staticmethod
+    def _download_opts(other, exclude):
+        # NB: `exclude` is read upon exit, so it may be appended to in the meantime
+        names = [Path(p).expanduser().resolve().name for p in other]
+        return ["--update", *[f"--exclude=/{x}" for x in [*names, *exclude]]]
+
     @contextmanager
-    def sym_sync(self, target_dir: Path | str, source_dir: Path, *other):
-        """Upload `source_dir` and all `other` to `target_dir` on host. Download upon exit/exception."""
+    def sym_sync(self, target_dir: Path | str, source_dir: Path, *other, exclude=(), lazy=()):
+        """Upload `source_dir` and `other` to `target_dir` on host. Download upon exit/exception.
+
+        The download skips `other` (since it came from here), and `exclude` (e.g. `"res/"`).
+        The upload skips `lazy` (e.g. `"/xps/*"`), which is left to `push` (e.g. when needed).
+        """
         # Sync source -> target
         self.cmd(f"mkdir -p {target_dir}")
-        self.rsync(f"{source_dir}/", target_dir)
+        opts = ["--update", *[f"--exclude={x}" for x in lazy]]  # don't clobber (resumed) results
+        self.rsync(f"{source_dir}/", target_dir, opts)
         # Sync other.name -> target/
         for p in other:
             p = Path(p).expanduser().resolve()
             assert p != Path.home(), "You probably do not want to sync your entire home dir."
-            self.rsync(f"{p}/", Path(target_dir) / p.name)
+            if self.snapshots:
+                self.snapshot(p, Path(target_dir) / p.name)
+            else:
+                self.rsync(f"{p}/", Path(target_dir) / p.name)
 
         # Reverse sync (i.e. download results) when exiting
         try:
             yield
         finally:
-            self.rsync(f"{source_dir}", f"{target_dir}/", reverse=True)
+            opts = self._download_opts(other, exclude)
+            self.rsync(f"{source_dir}", f"{target_dir}/", opts, reverse=True)
@@ -1,4 +1,563 @@
+import numpy as np
 import xp
 
 def test_a():
     assert xp.a == 6
+
+
+def test_cache(tmp_path):
+    from xp.cache import Cache
+
+    def fun(a, b):
+        return a + b
+
+    cache = Cache(tmp_path, fun, "script.py")
+    key = cache.key(dict(a=1, b=2))
+    assert key == cache.key(dict(b=2, a=1))
+    assert key != cache.key(dict(a=1, b=3))
+    assert key not in cache
+    cache[key] = 3
+    assert key in cache
+    assert cache[key] == 3
+
+    # Versioned by the repo of the script (not the cwd), incl. uncommitted changes
+    import subprocess
+
+    repo = tmp_path / "repo"
+    script = repo / "script.py"
+    repo.mkdir()
+    script.write_text("x = 1\n")
+    git = ["git", "-C", str(repo), "-c", "user.name=a", "-c", "user.email=a@b"]
+    subprocess.run([*git, "init", "-q"], check=True)
+    subprocess.run([*git, "add", "."], check=True)
+    subprocess.run([*git, "commit", "-qm", "init"], check=True)
+    clean = Cache(tmp_path, fun, script).dir
+    assert "+" not in clean.name
+    script.write_text("x = 2\n")
+    assert Cache(tmp_path, fun, script).dir != clean
+
+
+def test_cache_dispatch(tmp_path, monkeypatch):
+    """Dispatch only the misses (with the same options), and resume them if they failed."""
+    import importlib.util
+    import re
+    from pathlib import Path
+
+    import pytest
+
+    monkeypatch.setenv("HOME", str(tmp_path))
+    proj = tmp_path / "a" / "b" / "proj"
+    proj.mkdir(parents=True)
+    (proj / "pyproject.toml").write_text("")
+    script = proj / "script.py"
+    script.write_text(
+        "from pathlib import Path\n"
+        "def fun(x):\n"
+        "    if x == 2 and not (Path(__file__).parent / 'ok').exists():\n"
+        "        raise RuntimeError('flaky')\n"
+        "    return 10 * x\n"
+    )
+    spec = importlib.util.spec_from_file_location("script", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    kws = dict(script=script, data_root=tmp_path / "data", cache=True, retries=0, nCPU=1)
+
+    xp.dispatch(module.fun, [dict(x=x) for x in range(2)], **kws)
+    with pytest.raises(RuntimeError, match="some xps failed") as error:
+        xp.dispatch(module.fun, [dict(x=x) for x in range(4)], **kws)
+    resume = Path(re.search(r"resume='(.*)'", str(error.value))[1])
+    assert len(xp.load_batches(resume, "xps")) == 2  # only the misses
+    (proj / "ok").touch()
+    data_dir = xp.dispatch(module.fun, [dict(x=x) for x in range(4)], **kws, resume=resume)
+    assert data_dir == resume and xp.load_batches(data_dir) == [0, 10, 20, 30]
+
+
+def test_store(tmp_path):
+    from xp import store
+
+    path = tmp_path / "0"
+    with store.Writer(path) as writer:
+        writer.append(1, "b")
+        writer.append(0, "a")
+    # Simulate crash while writing
+    with open(path, "ab") as f:
+        f.write((2).to_bytes(8, "little") + (100).to_bytes(8, "little") + b"partial")
+    size = path.stat().st_size
+    assert store.done(path) == {0, 1}
+    assert path.stat().st_size == size  # read-only (the record might be still being written)
+    with store.Writer(path) as writer:  # drops the partial record
+        writer.append(2, "c")
+    assert store.load(path) == ["a", "b", "c"]
+
+
+def test_results(tmp_path):
+    from xp import save
+    from xp.results import load
+
+    xps = [dict(method=m, N=N, seed=s) for m in ["a", "b"] for N in [10, 20] for s in [0, 1]]
+    xps[0]["seed"] = None
+    for subdir in ["xps", "res"]:
+        (tmp_path / subdir).mkdir()
+    save(xps, tmp_path, 3)
+    save([dict(N=xp["N"] / 2, err=i) for i, xp in enumerate(xps)], tmp_path, 3, "res")
+
+    df = load(tmp_path)
+    assert list(df.columns) == ["method", "N", "seed", "result.N", "err"]
+    assert df["seed"].isna().sum() == 1
+    assert (df["err"] == range(len(xps))).all()
+    assert isinstance(df["err"].values, np.memmap)
+
+    da = load(tmp_path, "xarray")
+    assert dict(da.sizes) == dict(method=2, N=2, seed=3)
+
+
+def test_param_space():
+    from xp import ParamSpace
+    from xp.tools import dict_prod
+
+    common = ParamSpace.product(seed=[0, 1], N=[10, 100])
+    assert common.to_dicts() == dict_prod(seed=[0, 1], N=[10, 100])
+
+    methods = ParamSpace.from_dicts([dict(method="a"), dict(method="b", seed=None)])
+    xps = common * methods
+    assert len(xps) == 8
+    assert xps[1] == dict(seed=None, N=10, method="b")
+    assert len(xps.dedupe()) == 6
+    assert len(xps + common) == 12
+    assert (xps + common)[-1] == dict(seed=1, N=100)
+    assert len(xps.filter(xps.column("method") == "a")) == 4
+    assert xps.override(N=5)[2:4].to_dicts() == [dict(seed=0, N=5, method="a"),
+                                                 dict(seed=None, N=5, method="b")]
+
+
+def test_slurm():
+    from types import SimpleNamespace
+    from pathlib import Path
+    from xp import slurm
+
+    assert slurm.array_spec([7, 0, 1, 2, 5, 8]) == "0-2,5,7-8"
+    assert slurm.layout(10**6, 100) == (100, 100)
+    assert slurm.layout(50, 100) == (1, 50)
+
+    txt = slurm.render([0, 1, 3], 16, dict(time="02:00:00"), stage="~/data/a", venv="~/v",
+                       cwd="~/data/a/prj", script=Path("~/data/a/prj/s.py"), fun_name="f")
+    assert "#SBATCH --array=0-1,3" in txt
+    assert "#SBATCH --time=02:00:00" in txt
+    assert "launch_xps.py s f ~/data/a/xps/$SLURM_ARRAY_TASK_ID" in txt
+
+    sacct = "12_0|COMPLETED\n12_1|FAILED\n12_2|CANCELLED by 5\n12_[3-4,6%2]|PENDING\n"
+    remote = SimpleNamespace(cmd=lambda *a, **k: SimpleNamespace(stdout=sacct))
+    states = slurm.states(remote, 12)
+    assert states == {0: "COMPLETED", 1: "FAILED", 2: "CANCELLED", 3: "PENDING",
+                      4: "PENDING", 6: "PENDING"}
+
+
+def test_cost_scheduling():
+    from xp.costs import CostModel
+    from xp.local_mp import lpt_chunks, mp
+
+    costs = [1, 8, 1, 1, 4, 1]
+    chunks = list(lpt_chunks(costs, nCPU=1))
+    assert chunks[0] == [1] and sorted(i for c in chunks for i in c) == list(range(6))
+    assert mp(lambda x: x**2, range(50), nCPU=2, quiet=True, cost=lambda x: x % 7) == [
+        x**2 for x in range(50)
+    ]
+
+    model = CostModel([(dict(N=N, m="a"), 0.001 * N) for N in [10, 100, 1000]])
+    assert np.isclose(model(dict(N=100, m="a")), 0.1, rtol=0.3)
+    assert model(dict(N=10_000, m="b")) > model(dict(N=1000, m="a"))
+
+
+def test_instrument(tmp_path):
+    import dill
+
+    from xp import instrument, store
+
+    def fun(n):
+        return sum(range(n))
+
+    result, stats = instrument.measure(fun, dict(n=10**5), full=True)
+    assert result == sum(range(10**5))
+    assert stats["rss"] > 0 and stats["cpu"] > 0 and stats["wall"] > 0
+
+    result, stats = instrument.measure(fun, dict(n=1), profile=bool, dir_prof=tmp_path / "prof")
+    assert (tmp_path / stats["prof"]).exists()
+
+    (tmp_path / "xps").mkdir()
+    (tmp_path / "stats").mkdir()
+    (tmp_path / "xps" / "0").write_bytes(dill.dumps([dict(n=1), dict(n=2)]))
+    with store.Writer(tmp_path / "stats" / "0") as writer:
+        writer.append(1, stats)
+    df = xp.load_stats(tmp_path)
+    assert list(df["n"]) == [1, 2] and np.isnan(df["wall"][0])
+
+
+def test_faults():
+    import os
+    import signal
+
+    from xp import faults
+
+    def job(kwargs):
+        if kwargs["x"] < 0:
+            raise ValueError("negative")
+        if kwargs["x"] == 0:
+            os.kill(os.getpid(), signal.SIGSEGV)
+        return kwargs["x"], {}
+
+    assert faults.guard(job, dict(x=1)) == (1, {})
+    failure = faults.guard(job, dict(x=-1), retries=2)
+    assert failure.record["type"] == "ValueError" and failure.record["attempts"] == 3
+    failure = faults.guard(job, dict(x=0), isolate=True)
+    assert failure.record["error"] == "Killed by SIGSEGV"
+    assert faults.guard(job, dict(x=2), isolate=True) == (2, {})
+
+
+def test_env_fingerprint(tmp_path):
+    (tmp_path / "uv.lock").write_text("a")
+    fp = xp.env_fingerprint(tmp_path)
+    (tmp_path / "main.py").write_text("print(1)")
+    assert xp.env_fingerprint(tmp_path) == fp
+    (tmp_path / "uv.lock").write_text("b")
+    assert xp.env_fingerprint(tmp_path) != fp
+
+    class Remote:
+        def cmd(self, cmd, **kwargs):
+            self.last = cmd
+
+    remote = Remote()
+    xp.sync_venv(remote, "proj", "venv", fp)
+    assert fp in remote.last and "uv sync" in remote.last
+
+
+def test_sync_venv(tmp_path):
+    """Skipping the sync (same fingerprint) still re-installs the project from the new dir."""
+    import os
+    import subprocess
+
+    bin = tmp_path / "bin"
+    venv = tmp_path / "venv"
+    (venv / "bin").mkdir(parents=True)
+    bin.mkdir()
+    log = tmp_path / "uv.log"
+    (bin / "uv").write_text(f'#!/bin/sh\necho "$(basename $PWD) $1" >> {log}\n')
+    (venv / "bin" / "python").write_text("#!/bin/sh\necho Python 3.12.0\n")
+    for f in [bin / "uv", venv / "bin" / "python"]:
+        f.chmod(0o755)
+
+    class Remote:
+        def cmd(self, cmd, **kwargs):
+            env = dict(os.environ, PATH=f"{bin}:{os.environ['PATH']}")
+            return subprocess.run(["bash", "-c", cmd], env=env, check=True)
+
+    for name in ["run1", "run2"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "pyproject.toml").write_text("[build-system]\n")
+        xp.sync_venv(Remote(), tmp_path / name, venv, "fp")
+    assert log.read_text().splitlines() == ["run1 sync", "run2 pip"]
+    (venv / "bin" / "python").write_text("#!/bin/sh\necho Python 3.13.0\n")
+    xp.sync_venv(Remote(), tmp_path / "run2", venv, "fp")
+    assert log.read_text().splitlines()[-1] == "run2 sync"
+
+
+def test_warmup(tmp_path, monkeypatch):
+    """The snapshot uploaded by `warmup` gets used by `dispatch` (as its fingerprint matches)."""
+    import re
+    import subprocess
+    from pathlib import Path
+
+    import pytest
+    from xp import uplink
+
+    monkeypatch.setenv("HOME", str(tmp_path))
+    proj = tmp_path / "a" / "b" / "proj"
+    proj.mkdir(parents=True)
+    (proj / "pyproject.toml").write_text("")
+    (proj / "script.py").write_text("def fun(x):\n    return x\n")
+
+    snaps, hits = set(), []
+
+    def cmd(self, cmd, **kwargs):
+        found = any(f"/{key} && echo found" in cmd for key in snaps)
+        if "echo found" in cmd:
+            hits.append(found)
+        snaps.update(re.findall(r"ln -sfn (\w+)", cmd))  # finalize
+        return subprocess.CompletedProcess(cmd, 0, "found" if found else "", "")
+
+    class Stop(Exception):
+        pass
+
+    def worker(*args, **kwargs):
+        raise Stop  # i.e. instead of running the xps
+
+    monkeypatch.setattr(uplink.Uplink, "cmd", cmd)
+    monkeypatch.setattr(uplink.Uplink, "rsync_args", lambda self, *args, **kwargs: ["true"])
+    monkeypatch.setattr(xp, "sync_venv", lambda *args, **kwargs: None)
+    monkeypatch.setattr(xp.progress, "Worker", worker)
+
+    xp.warmup("host", proj)
+    assert hits == [False]
+    with pytest.raises(Stop):
+        kws = dict(data_root=tmp_path / "data", data_root_on_remote=Path("/remote"))
+        xp.dispatch(lambda x: x, [dict(x=1)], "host", proj / "script.py", **kws)
+    assert hits == [False, True]
+
+
+def test_capabilities(monkeypatch):
+    import subprocess
+
+    from xp import uplink
+
+    out = "Welcome!\nnCPU=8\nmem=MemAvailable: 1024 kB\n"
+
+    def cmd(self, cmd, **kwargs):
+        return subprocess.CompletedProcess(cmd, 0, out, "")
+
+    monkeypatch.setattr(uplink.Uplink, "cmd", cmd)
+    monkeypatch.setattr(uplink.Uplink, "_probed", {})
+    caps = uplink.Uplink("host").capabilities()
+    assert caps == dict(nCPU=8, mem=2**20)
+
+
+def test_only():
+    from xp.uplink import Uplink
+
+    rules = Uplink._only(["xps", "res/3"])
+    assert "--include=/xps/***" in rules  # ⇒ its contents, not just the (empty) dir
+    assert rules.index("--include=/res/") < rules.index("--include=/res/3")
+    assert rules[-1] == "--exclude=*"
+
+
+def test_uplink_bounds(monkeypatch):
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from xp import uplink
+
+    lock, live, peak = threading.Lock(), [0], [0]
+
+    def run(*args, **kwargs):
+        with lock:
+            live[0] += 1
+            peak[0] = max(peak[0], live[0])
+        time.sleep(0.01)
+        with lock:
+            live[0] -= 1
+
+    monkeypatch.setattr(uplink.subprocess, "run", run)
+    monkeypatch.setattr(uplink.Uplink, "rsync_args", lambda self, *args, **kwargs: ["true"])
+    with ThreadPoolExecutor(30) as executor:
+        list(executor.map(lambda i: uplink.Uplink(f"host{i}").rsync("a", "b"), range(30)))
+    assert peak[0] == uplink.MAX_TRANSFERS
+    peak[0] = 0
+    with ThreadPoolExecutor(30) as executor:
+        list(executor.map(lambda i: uplink.Uplink("host").cmd("ls"), range(30)))
+    assert peak[0] == uplink.MAX_SESSIONS
+
+
+def test_reduce(tmp_path):
+    import dill
+
+    data_dir = xp.mk_data_dir(tmp_path)
+    xps = [dict(seed=s) for s in range(10)]
+    xp.save(xps, data_dir, 2)
+    xp.save([kw["seed"] ** 2 for kw in xps], data_dir, 2, "res")
+    (data_dir / "reducer").write_bytes(dill.dumps(lambda xps, res: sum(res) / len(res)))
+    assert xp.reduce.run(data_dir)
+    assert xp.load_reduced(data_dir) == 28.5
+
+
+def test_serial(tmp_path):
+    import dill
+
+    from xp import serial, store
+
+    obj = dict(x=np.arange(1000.0), y=[np.ones((3, 4)).T, "a"], z=np.array([None]))
+    for codec in [None, "zlib"]:
+        path = tmp_path / f"obj.{codec}"
+        serial.dump(obj, path, codec)
+        loaded = serial.load(path)
+        assert np.array_equal(loaded["x"], obj["x"]) and loaded["y"][0].shape == (4, 3)
+        assert loaded["x"].ctypes.data % serial.ALIGN == 0  # memory-mapped (aligned)
+
+        with store.Writer(tmp_path / f"store.{codec}", codec) as writer:
+            writer.append(1, obj)
+            writer.append(0, "b")
+        assert store.load(tmp_path / f"store.{codec}")[1]["x"][-1] == 999
+
+    (tmp_path / "old").write_bytes(dill.dumps([1, 2]))
+    assert serial.load(tmp_path / "old") == [1, 2]
+
+
+def test_shards(tmp_path):
+    assert xp.shards(10, 4) == [(0, 2), (2, 5), (5, 7), (7, 10)]
+    assert xp.shards(2, 4) == [(0, 1), (1, 2)]  # no empty shards
+
+    data_dir = xp.mk_data_dir(tmp_path)
+    xps = [dict(i=i) for i in range(41)]
+    xp.save(xps, data_dir, 4)
+    assert xp.manifest(data_dir)["counts"] == [10, 10, 10, 11]
+    assert xp.load_batches(data_dir, "xps") == xps
+    batch, index = xp.locate(data_dir, 35)
+    assert xp.serial.load(data_dir / "xps" / str(batch))[index] == dict(i=35)
+    assert xp.incomplete(data_dir) == [0, 1, 2, 3]
+
+    # In the background (⇒ futures of the paths, in order)
+    from concurrent.futures import ThreadPoolExecutor
+
+    data_dir = xp.mk_data_dir(tmp_path, tags="bg")
+    with ThreadPoolExecutor() as executor:
+        saving = xp.save(xps, data_dir, 4, executor=executor)
+        assert [f.result().name for f in saving] == ["0", "1", "2", "3"]
+    assert xp.load_batches(data_dir, "xps") == xps
+
+
+def test_worker_imports():
+    import subprocess
+    import sys
+
+    # The worker (`launch_xps`) should not import the analysis/orchestration deps
+    heavy = ["numpy", "pandas", "xarray", "matplotlib", "tqdm", "asyncio", "pathos"]
+    code = "import sys, time; t0 = time.perf_counter(); import xp.launch_xps;"
+    code += "print(time.perf_counter() - t0, *sys.modules)"
+    seconds, *modules = subprocess.run([sys.executable, "-c", code], **xp.responsive).stdout.split()
+    assert not {m.split(".")[0] for m in modules} & set(heavy)
+    assert float(seconds) < 1  # budget (generous, for slow CI), typically 0.1
+
+
+def test_layout():
+    from xp.local_mp import layout, mp
+
+    assert layout(8, 2) == (4, 2)
+    assert layout(8, n=100) == (8, 1)
+    assert layout(8, n=3) == (3, 2)  # share out the CPUs
+    assert layout(0) == (1, 1)
+
+    def blas(_):
+        import threadpoolctl
+
+        info = threadpoolctl.threadpool_info()
+        return [i["num_threads"] for i in info if i["user_api"] == "blas"]
+
+    assert set(sum(mp(blas, range(4), nCPU=4, threads=2, quiet=True), [])) <= {2}
+    assert mp(lambda x: x**2, range(20), 4, True, backend="thread") == [x**2 for x in range(20)]
+
+
+def test_recycling(tmp_path, monkeypatch):
+    import os
+
+    from xp import instrument
+    from xp.local_mp import mp
+
+    hog = []
+
+    def leak(x):
+        hog.append(np.ones(2**20))  # 8 MB
+        if x == 5 and not (tmp_path / "died").exists():
+            (tmp_path / "died").touch()
+            os._exit(9)  # e.g. killed by OOM ⇒ re-run
+        return x, os.getpid()
+
+    out = mp(leak, range(20), nCPU=2, quiet=True, chunksize=1, mem=2**30)
+    assert [x for x, _ in out] == list(range(20))
+    assert len({pid for _, pid in out}) >= 2
+    out = mp(leak, range(20), nCPU=2, quiet=True, chunksize=1, maxtasks=4)
+    assert len({pid for _, pid in out}) >= 5
+
+    # Only room for 1 worker ⇒ recycled in turn
+    monkeypatch.setattr(instrument, "mem_available", lambda: 2**20)
+    out = mp(leak, range(20), nCPU=4, quiet=True, chunksize=1, mem=2**20)
+    assert [x for x, _ in out] == list(range(20))
+    assert len({pid for _, pid in out}) == 20
+
+
+def test_stream():
+    from xp.local_mp import chunked, imap_chunks
+
+    def stream():  # e.g. of batches, as they are received by `launch_xps.serve`
+        for batch in ["a", "b"]:
+            for chunk in chunked([1, 2, 3], 2, chunksize=2):
+                yield [((batch, j), x) for j, x in chunk]
+            yield None  # i.e. none yet
+
+    expected = {(batch, j): 10 * x for batch in "ab" for j, x in enumerate([1, 2, 3])}
+    for kws in [{}, dict(backend="thread"), dict(maxtasks=1)]:
+        assert dict(imap_chunks(lambda x: 10 * x, stream(), 2, **kws)) == expected
+
+
+def test_catalog(tmp_path, capsys):
+    from xp import catalog
+
+    for i, (method, Ns) in enumerate([("X", [10, 100]), ("Y", [1000]), ("X", [1000, 2000])]):
+        data_dir = xp.mk_data_dir(tmp_path / "proj" / "script", tags=f"run{i}")
+        xps = [dict(method=method, N=N, arr=np.zeros(2)) for N in Ns]
+        xp.save(xps, data_dir, 1)
+        if i < 2:
+            catalog.register(tmp_path, data_dir, xps, sha=f"abc{i}", created=f"2026-01-0{i + 1}")
+
+    assert [r["sha"] for r in catalog.query(tmp_path)] == ["abc1", "abc0"]  # latest first
+    assert len(catalog.query(tmp_path, "method=X", "N>=1000")) == 0
+    assert catalog.query(tmp_path, "N>=1000", sha="abc")[0]["sha"] == "abc1"
+    assert catalog.query(tmp_path, "sha=abc0", params=True)[0]["params"] == dict(
+        method=["X"], N=[10, 100]
+    )
+    assert xp.find_latest_run(tmp_path / "proj" / "script") == "run1"  # (not a timestamp)
+
+    # Filtered `ParamSpace` ⇒ only the values in use
+    xps = xp.ParamSpace.product(N=[10, 100, 1000], m=["a", "b"])
+    xps = xps.filter(xps.column("N") < 1000)[1:]
+    assert catalog.summary(xps) == dict(N=[10, 100], m=["a", "b"])
+
+    assert catalog.index(tmp_path) == 1  # run2
+    assert catalog.query(tmp_path, "method=X", "N>=1000")[0]["status"] == "incomplete"
+    xp.main(["--root", str(tmp_path), "ls", "-n", "1", "N=2000"])
+    assert capsys.readouterr().out.strip().endswith("run2")
+
+
+def test_pilot():
+    from xp import pilot
+    from xp.costs import CostModel
+
+    xps = [dict(m=m, N=N, seed=s) for m in "ab" for N in [10, 100, 1000] for s in range(50)]
+    idx = pilot.sample(xps, 10)
+    assert len(idx) == 10
+    assert {xps[i]["m"] for i in idx} == {"a", "b"}
+    assert {xps[i]["N"] for i in idx} == {10, 100, 1000}
+
+    wall = CostModel([(xps[i], 0.01 * xps[i]["N"]) for i in idx])
+    assert np.isclose(sum(map(wall, xps)), 1110)  # ignores seed
+    space = xp.ParamSpace.from_dicts([*xps[::7], dict(m="a"), dict(N=5000)])  # incl. absent
+    assert np.allclose(wall.predict(space), [wall(kwargs) for kwargs in space])
+    rss = CostModel([(xps[i], 2**30) for i in idx])
+    assert pilot.plan(xps, wall, rss, nCPU=8, mem=5 * 2**30)["nCPU"] == 2  # memory-bound
+    plan = pilot.plan(xps, wall, rss, nCPU=4, sbatch=True)
+    assert plan["nBatch"] == 1 and plan["sbatch"] == {"time": "00:14:16", "mem-per-cpu": "2048M"}
+    assert pilot.walltime(90061) == "1-01:01:01"
+
+
+def test_adaptive(tmp_path, monkeypatch):
+    from xp import adaptive
+
+    assert adaptive.halfwidth([1.0]) == float("inf")
+    assert np.isclose(adaptive.halfwidth([1.0, 3.0]), 12.706)
+
+    def fake_dispatch(fun, xps, **kwargs):  # runs in-process
+        data_dir = xp.mk_data_dir(tmp_path, tags=str(len(list(tmp_path.iterdir()))))
+        xp.save(xps, data_dir, 1)
+        with xp.store.Writer(data_dir / "res" / "0") as writer:
+            for i, kw in enumerate(xps):
+                if kw["seed"] != 13:  # ⇒ failed
+                    writer.append(i, fun(**kw))
+        return data_dir
+
+    def fun(noise, seed):
+        return noise * np.random.default_rng(seed).normal() if seed is not None else 0.0
+
+    monkeypatch.setattr(xp, "dispatch", fake_dispatch)
+    configs = [dict(noise=0.01), dict(noise=1.0), dict(noise=1.0, seed=None)]
+    xps, results = adaptive.sweep(fun, configs, abs, tol=0.15, seeds=range(100))
+    assert len(xps) == len(results)
+    counts = [sum(kw["noise"] == a and kw["seed"] is not None for kw in xps) for a in [0.01, 1]]
+    assert counts[0] == 2 and 30 < counts[1] < 99  # few seeds where converged
+    assert sum(kw["seed"] is None for kw in xps) == 1